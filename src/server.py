@@ -0,0 +1,673 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import yaml
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from compiler import generate_runtime_code
+
+STORY_DIR = 'stories/yaml'
+GREETING = "Lore Lock server. Stories: {}\nType 'play <story> [session]' to begin.\n> "
+
+def load_runtime():
+    # The engine is executed once per process; every story and session shares it
+    namespace = {}
+    exec(generate_runtime_code(), namespace)
+    return namespace
+
+def load_story(story_id):
+    with open(os.path.join(STORY_DIR, story_id + ".yaml"), 'r') as f:
+        return yaml.safe_load(f)
+
+def available_stories():
+    if not os.path.exists(STORY_DIR): return []
+    return sorted(os.path.splitext(f)[0] for f in os.listdir(STORY_DIR) if f.endswith(".yaml"))
+
+def parse_hello(line, stories):
+    # 'play <story> [session]' -> (story, session id); the story may be omitted when only one is served
+    words = line.split()
+    if len(words) == 1 and words[0] == 'play' and len(stories) == 1: words.append(stories[0])
+    if len(words) not in (2, 3) or words[0] != 'play' or words[1] not in stories: return None
+    return words[1], words[2] if len(words) == 3 else os.urandom(4).hex()
+
+def deep_size(obj, seen):
+    # Rough resident size of a story's data and entity tree, for the registry's memory budget
+    if id(obj) in seen: return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict): size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)): size += sum(deep_size(v, seen) for v in obj)
+    elif hasattr(obj, '__dict__') and not callable(obj): size += deep_size(obj.__dict__, seen)
+    return size
+
+class StoryEntry:
+    def __init__(self, world):
+        self.world = world
+        self.sessions = 0
+        self.size = deep_size((world.data, world.entities), {id(world)})
+        # One serialized world state; sessions are costed as multiples of it
+        self.state_bytes = len(json.dumps(world.save_state_to_memory()))
+
+class StoryRegistry:
+    # Story templates loaded on first use and shared by every session of the story. Stories without
+    # resident sessions are evicted least recently used first once the total exceeds the budget.
+    def __init__(self, budget=32 * 1024 * 1024):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+        self._runtime = None
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    @property
+    def runtime(self):
+        # The engine itself is only executed when the first story is needed
+        with self._lock:
+            if self._runtime is None: self._runtime = load_runtime()
+            return self._runtime
+
+    def template(self, story_id, acquire=False):
+        # acquire=True also counts a new session against the story, atomically with the lookup
+        with self._lock:
+            if story_id in self.entries:
+                self.entries.move_to_end(story_id)
+                self.entries[story_id].sessions += 1 if acquire else 0
+                return self.entries[story_id].world
+            gate = self._loading.setdefault(story_id, threading.Lock())
+        # Concurrent first requests for one story wait for a single build
+        with gate:
+            with self._lock:
+                if story_id in self.entries:
+                    self.entries[story_id].sessions += 1 if acquire else 0
+                    return self.entries[story_id].world
+            entry = StoryEntry(self.runtime['World'](load_story(story_id), story_id=story_id))
+            entry.sessions += 1 if acquire else 0
+            with self._lock:
+                self.entries[story_id] = entry
+                self._loading.pop(story_id, None)
+                self.loads += 1
+                self._evict()
+        return entry.world
+
+    def state_bytes(self, story_id):
+        entry = self.entries.get(story_id)
+        return entry.state_bytes if entry else 0
+
+    def release(self, story_id):
+        with self._lock:
+            if story_id in self.entries: self.entries[story_id].sessions -= 1
+            self._evict()
+
+    def resident_bytes(self):
+        return sum(entry.size for entry in self.entries.values())
+
+    def _evict(self):
+        while self.resident_bytes() > self.budget:
+            idle = [story_id for story_id, entry in self.entries.items() if entry.sessions <= 0]
+            # The most recently used story stays even when it alone exceeds the budget
+            if not idle or idle[0] == next(reversed(self.entries)): return
+            del self.entries[idle[0]]
+            self.evictions += 1
+
+    def preload(self, story_ids, executor):
+        # Hot stories are built concurrently at startup so their first players don't wait
+        return list(executor.map(self.template, story_ids))
+
+class SessionStore:
+    # Hibernated sessions, one JSON snapshot per row; only ever used from the server's store thread
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+
+    def _conn(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, story TEXT, snapshot TEXT, saved REAL)")
+        return self._db
+
+    def put(self, session_id, snapshot):
+        with self._conn() as db:
+            db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                       (session_id, snapshot['story'], json.dumps(snapshot), time.time()))
+
+    def get(self, session_id):
+        row = self._conn().execute("SELECT snapshot FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, session_id):
+        with self._conn() as db:
+            db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def close(self):
+        if self._db is not None: self._db.close()
+        self._db = None
+
+    def popular(self, limit):
+        rows = self._conn().execute("SELECT story FROM sessions GROUP BY story ORDER BY COUNT(*) DESC LIMIT ?", (limit,))
+        return [story for story, in rows]
+
+class Session:
+    # One player's World; turns run on a worker thread, one at a time
+    remote = False
+
+    def __init__(self, session_id, template, runtime):
+        self.id = session_id
+        self.story_id = template.story_id
+        self.sink = runtime['MemorySink']()
+        self.world = template.clone(io=runtime['GameIO'](self.sink))
+        self.world.ai.session = session_id
+        # A save belongs to this session and is kept in its snapshots, not in a file shared by the story
+        self.world.save_file = None
+        self.busy = False
+        self.dirty = False
+        self.finished = False
+        self.resumed = False
+        self.last_active = time.monotonic()
+
+    @property
+    def started(self):
+        return self.resumed or self.world.turn > 0
+
+    def footprint(self, state_bytes):
+        # Undo states dominate a session's memory; each is about one serialized world state
+        return state_bytes * (1 + len(self.world.history)) + sum(len(t) for t in self.world.io.history)
+
+    def snapshot(self):
+        return self.world.snapshot()
+
+    def restore(self, snapshot):
+        self.world.restore(snapshot)
+
+    def start(self):
+        self.world.intro()
+        self.world.io.flush()
+        return self.sink.drain()
+
+    def resume(self):
+        self.world.look()
+        self.world.io.flush()
+        return self.sink.drain()
+
+    def turn(self, line):
+        self.last_active = time.monotonic()
+        if line.strip() == "quit":
+            self.finished = True
+            return "Goodbye.\n"
+        res = self.world.parse(line)
+        won = res != "menu" and self.world.check_win()
+        self.world.io.flush()
+        self.finished = res == "menu" or won
+        return self.sink.drain()
+
+class Connection:
+    # A client stream attached to a session; what moves when a session migrates between workers
+    def __init__(self, reader, writer, queue_size):
+        loop = asyncio.get_running_loop()
+        self.reader = reader
+        self.writer = writer
+        self.queue = asyncio.Queue(queue_size)
+        self.moving = loop.create_future()
+        self.closed = loop.create_future()
+
+class GameServer:
+    def __init__(self, stories=None, max_command=512, idle_timeout=600, write_timeout=30, queue_size=8, workers=16,
+                 store='sessions.db', memory_budget=64 * 1024 * 1024, hibernate_after=300, checkpoint=0,
+                 story_budget=32 * 1024 * 1024, preload=None, preload_count=4, registry=None, subinterpreters=False):
+        self.stories = stories or available_stories()
+        self.max_command = max_command
+        self.idle_timeout = idle_timeout
+        self.write_timeout = write_timeout
+        self.queue_size = queue_size
+        self.memory_budget = memory_budget
+        self.hibernate_after = hibernate_after
+        self.checkpoint = checkpoint
+        self.registry = registry or StoryRegistry(story_budget)
+        self.preload_stories = preload
+        self.preload_count = preload_count
+        # Subinterpreter mode: each story runs in its own interpreter (and GIL) inside this process
+        self.interpreters = None
+        if subinterpreters:
+            from subinterpreters import StoryInterpreters
+            self.interpreters = StoryInterpreters(workers)
+        # Resident sessions in LRU order (least recently used first)
+        self.sessions = OrderedDict()
+        self.connected = set()
+        self.connections = {}
+        self.control = None
+        self.hibernated = 0
+        self.restored = 0
+        self.store = SessionStore(store)
+        self._saving = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lore-lock-turn")
+        self.store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lore-lock-store")
+
+    def resident_bytes(self):
+        return sum(s.footprint(self.registry.state_bytes(s.story_id)) for s in self.sessions.values())
+
+    async def preload(self):
+        # Explicit --preload stories, otherwise the ones with the most stored sessions
+        stories = self.preload_stories
+        if stories is None: stories = await self.in_store(self.store.popular, self.preload_count)
+        stories = [s for s in stories if s in self.stories]
+        if not stories: return
+        loop = asyncio.get_running_loop()
+        host = self.interpreters or self.registry
+        await loop.run_in_executor(None, host.preload, stories, self.executor)
+
+    async def in_store(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.store_executor, fn, *args)
+
+    async def session(self, session_id, story_id=None):
+        # Resident sessions are returned as-is; hibernated ones are thawed into a fresh clone
+        lost = self.sessions.get(session_id)
+        if lost and lost.remote and not lost.story.alive():
+            # Its story's interpreter died; the last stored snapshot is all that is left
+            del self.sessions[session_id]
+        if session_id in self.sessions:
+            if story_id not in (None, self.sessions[session_id].story_id): return None
+            self.sessions.move_to_end(session_id)
+            return self.sessions[session_id]
+        if session_id in self._saving: await self._saving[session_id]
+        snapshot = await self.in_store(self.store.get, session_id)
+        if snapshot is None and story_id is None: return None
+        if snapshot is not None and story_id not in (None, snapshot['story']): return None
+        loop = asyncio.get_running_loop()
+        story_id = story_id or snapshot['story']
+        session = await loop.run_in_executor(self.executor, self.new_session, session_id, story_id, snapshot)
+        if session_id in self.sessions:
+            self.release(session)
+            return self.sessions[session_id]
+        if snapshot is not None:
+            session.resumed = True
+            self.restored += 1
+        self.sessions[session_id] = session
+        await self.enforce_budget()
+        return session
+
+    def new_session(self, session_id, story_id, snapshot):
+        # Runs on a worker thread: a clone of the story's template, or a world in its interpreter
+        if self.interpreters: return self.interpreters.get(story_id).open(session_id, snapshot)
+        session = Session(session_id, self.registry.template(story_id, True), self.registry.runtime)
+        if snapshot is not None: session.restore(snapshot)
+        return session
+
+    async def snapshot(self, session):
+        # Local worlds are idle and snapshot on the loop thread; remote ones answer off the loop
+        if not session.remote: return session.snapshot()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, session.snapshot)
+
+    async def hibernate(self, session):
+        # The session leaves the resident set at once; a player returning mid-save waits for the write
+        if self.sessions.pop(session.id, None) is None: return
+        self.hibernated += 1
+        saving = asyncio.ensure_future(self.freeze(session))
+        self._saving[session.id] = saving
+        try: await saving
+        finally:
+            if self._saving.get(session.id) is saving: del self._saving[session.id]
+        self.released(session.id)
+
+    async def freeze(self, session):
+        try: snapshot = await self.snapshot(session)
+        finally: self.release(session)
+        await self.in_store(self.store.put, session.id, snapshot)
+
+    async def save(self, session):
+        # Checkpoint a resident session so a crashed worker's players resume from the store
+        session.dirty = False
+        await self.in_store(self.store.put, session.id, await self.snapshot(session))
+
+    def unload(self, session):
+        if self.sessions.pop(session.id, None) is not None: self.release(session)
+
+    def release(self, session):
+        # The session's story becomes evictable once its last resident session is gone
+        if session.remote: session.close()
+        else: self.registry.release(session.story_id)
+
+    def close(self):
+        if self.interpreters: self.interpreters.close()
+
+    async def discard(self, session):
+        self.unload(session)
+        await self.in_store(self.store.delete, session.id)
+        self.released(session.id)
+
+    def released(self, session_id):
+        # Worker mode: once the session is neither resident nor connected here, the supervisor may
+        # route it by the ring again
+        if self.control is None or session_id in self.sessions or session_id in self.connected: return
+        try: socket.send_fds(self.control, [json.dumps({'op': 'released', 'session': session_id}).encode('utf-8')], [])
+        except OSError: pass
+
+    async def enforce_budget(self):
+        # Least recently used idle sessions go to disk until the resident estimate fits the budget
+        while self.resident_bytes() > self.memory_budget:
+            idle = [s for s in self.sessions.values() if not s.busy]
+            if len(idle) <= 1: return
+            await self.hibernate(idle[0])
+
+    async def sweep(self, interval=None):
+        interval = interval or max(1, min(60, self.hibernate_after / 4, self.checkpoint or 60))
+        while True:
+            await asyncio.sleep(interval)
+            cutoff = time.monotonic() - self.hibernate_after
+            for session in [s for s in self.sessions.values() if s.last_active < cutoff and not s.busy]:
+                if session.id in self.sessions: await self.hibernate(session)
+            await self.enforce_budget()
+            if self.checkpoint:
+                for session in [s for s in self.sessions.values() if s.dirty and not s.busy]:
+                    await self.save(session)
+
+    async def send(self, writer, text):
+        # Bounded drain: a client that stops reading is disconnected instead of buffering forever
+        writer.write(text.encode('utf-8'))
+        try:
+            await asyncio.wait_for(writer.drain(), self.write_timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError("client is not reading")
+
+    async def readline(self, reader):
+        # Returns None on EOF or idle timeout
+        try:
+            return await asyncio.wait_for(self.read_line(reader), self.idle_timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def read_line(self, reader):
+        # A line that overruns the stream buffer is read through to its newline and comes back cut to
+        # max_command + 1 bytes, so it is refused as too long instead of ending the connection
+        head = None
+        while True:
+            try:
+                line = await reader.readuntil(b"\n")
+            except asyncio.IncompleteReadError as e:
+                line = e.partial
+                if not line and head is None: return None
+            except asyncio.LimitOverrunError as e:
+                chunk = await reader.readexactly(e.consumed)
+                if head is None: head = chunk[:self.max_command + 1]
+                continue
+            return line if head is None else head
+
+    async def run(self, session, fn, *args):
+        session.busy = True
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            session.busy = False
+            session.dirty = True
+            session.last_active = time.monotonic()
+
+    async def open_session(self, reader, writer, hello=None):
+        # A supervisor that already greeted the client hands over the hello line it read
+        if hello is None: await self.send(writer, GREETING.format(", ".join(self.stories)))
+        while True:
+            line = hello or await self.readline(reader)
+            hello = None
+            if line is None: return None
+            line = line.decode('utf-8', 'replace')
+            if line.split() == ['quit']: return None
+            request = parse_hello(line, self.stories)
+            if request is None:
+                await self.send(writer, "Unknown story.\n> ")
+                continue
+            story_id, session_id = request
+            if session_id in self.connected:
+                await self.send(writer, f"Session {session_id} is already connected.\n> ")
+                continue
+            self.connected.add(session_id)
+            session = await self.session(session_id, story_id)
+            if session is None:
+                self.connected.discard(session_id)
+                await self.send(writer, f"Session {session_id} belongs to another story.\n> ")
+                continue
+            output = await self.run(session, session.resume if session.started else session.start)
+            await self.send(writer, f"[session {session_id}]\n" + output + "> ")
+            return session_id
+
+    async def play(self, session_id, conn):
+        # Drains one session's queue in order; parse (and any AI fallback) runs off the event loop
+        while not conn.moving.done():
+            get = asyncio.ensure_future(conn.queue.get())
+            await asyncio.wait({get, conn.moving}, return_when=asyncio.FIRST_COMPLETED)
+            if not get.done():
+                get.cancel()
+                return
+            line = get.result()
+            if len(line) > self.max_command:
+                await self.send(conn.writer, f"That command is too long (limit {self.max_command} bytes).\n> ")
+                continue
+            session = await self.session(session_id)
+            try:
+                output = await self.run(session, session.turn, line.decode('utf-8', 'replace').rstrip("\r\n"))
+            except RuntimeError:
+                # Raised for remote sessions whose story failed in its interpreter
+                if not session.remote: raise
+                await self.send(conn.writer, "The story stopped unexpectedly; reconnect to carry on from the last save.\n")
+                return
+            if session.finished:
+                await self.discard(session)
+                await self.send(conn.writer, output)
+                return
+            await self.send(conn.writer, output + "> ")
+
+    async def handle(self, reader, writer, hello=None):
+        session_id = None
+        try:
+            session_id = await self.open_session(reader, writer, hello)
+        except (ConnectionError, OSError):
+            pass
+        if session_id is None:
+            writer.close()
+            return
+        await self.attach(session_id, reader, writer)
+
+    async def attach(self, session_id, reader, writer):
+        conn = Connection(reader, writer, self.queue_size)
+        self.connections[session_id] = conn
+        player = asyncio.ensure_future(self.play(session_id, conn))
+        line = None
+        moved = False
+        try:
+            while not player.done() and not conn.moving.done():
+                # A full queue blocks the put, so a client typing ahead of its turns stops being read
+                step = asyncio.ensure_future(self.readline(reader) if line is None else conn.queue.put(line))
+                await asyncio.wait({step, player, conn.moving}, return_when=asyncio.FIRST_COMPLETED)
+                if not step.done():
+                    step.cancel()
+                    break
+                if line is not None:
+                    line = None
+                    continue
+                line = step.result()
+                if line is None:
+                    if not player.done(): await self.send(writer, "\nConnection idle; goodbye.\n")
+                    break
+            if conn.moving.done():
+                # The turn in flight (including any AI call) completes and is delivered here first
+                await player
+                moved = await self.hand_over(session_id, conn, line)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if not player.done():
+                player.cancel()
+                try: await player
+                except (asyncio.CancelledError, ConnectionError, OSError): pass
+            # Disconnected sessions stay registered; the sweeper hibernates them once idle
+            self.connections.pop(session_id, None)
+            self.connected.discard(session_id)
+            if not moved: self.released(session_id)
+            writer.close()
+            try: await writer.wait_closed()
+            except (ConnectionError, OSError): pass
+            conn.closed.set_result(moved)
+
+    async def hand_over(self, session_id, conn, carry):
+        # Unprocessed input travels with the socket: queued lines, a line waiting for queue space,
+        # then whatever is still buffered in the stream reader
+        session = self.sessions.get(session_id)
+        if session is None or session.finished or self.control is None: return False
+        conn.writer.transport.pause_reading()
+        await self.save(session)
+        self.unload(session)
+        pending = []
+        while not conn.queue.empty(): pending.append(conn.queue.get_nowait())
+        if carry is not None: pending.append(carry)
+        # Reading is paused, so after an EOF the reader gives up exactly what it has buffered
+        conn.reader.feed_eof()
+        pending.append(await conn.reader.read())
+        fd = conn.writer.get_extra_info('socket').fileno()
+        message = {'op': 'migrated', 'session': session_id, 'pending': b"".join(pending).decode('latin-1')}
+        socket.send_fds(self.control, [json.dumps(message).encode('utf-8')], [fd])
+        return True
+
+    def stream_limit(self):
+        # Bounds buffered input well above max_command; longer lines are read through and refused
+        return max(self.max_command * 4, 4096)
+
+    async def serve(self, host='127.0.0.1', port=4000, unix=None):
+        if unix:
+            server = await asyncio.start_unix_server(self.handle, path=unix, limit=self.stream_limit())
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=self.stream_limit())
+        where = unix or ", ".join(str(s.getsockname()) for s in server.sockets)
+        print(f"Serving {len(self.stories)} stories on {where}")
+        sweeper = asyncio.ensure_future(self.sweep())
+        asyncio.ensure_future(self.preload())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            sweeper.cancel()
+            self.close()
+
+    async def serve_control(self, control_fd):
+        # Worker mode: the supervisor passes client sockets (and migrating sessions) over a Unix socket
+        self.control = socket.socket(fileno=control_fd)
+        loop = asyncio.get_running_loop()
+        closed = loop.create_future()
+        tasks = set()
+
+        def spawn(coro):
+            task = asyncio.ensure_future(coro)
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        def receive():
+            try:
+                msg, fds, _, _ = socket.recv_fds(self.control, 65536, 1, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                msg, fds = b"", []
+            if not msg:
+                # Supervisor went away
+                if not closed.done(): closed.set_result(None)
+                return
+            message = json.loads(msg)
+            op = message.get('op')
+            if op == 'connect' and fds: spawn(self.adopt(fds[0], message['hello'].encode('utf-8')))
+            elif op == 'adopt' and fds: spawn(self.adopt_session(fds[0], message['session'], message['pending'].encode('latin-1')))
+            elif op == 'migrate': spawn(self.migrate(message['session']))
+            elif op == 'drain': spawn(self.drain())
+            else:
+                for fd in fds: os.close(fd)
+
+        loop.add_reader(self.control, receive)
+        sweeper = asyncio.ensure_future(self.sweep())
+        asyncio.ensure_future(self.preload())
+        try:
+            await closed
+        finally:
+            loop.remove_reader(self.control)
+            sweeper.cancel()
+            for session in [s for s in self.sessions.values() if s.dirty]: await self.save(session)
+            self.control.close()
+            self.close()
+
+    async def adopt(self, fd, hello):
+        reader, writer = await asyncio.open_connection(sock=socket.socket(fileno=fd), limit=self.stream_limit())
+        await self.handle(reader, writer, hello)
+
+    async def adopt_session(self, fd, session_id, pending):
+        # Resume a session migrated from another worker: thaw its checkpoint and replay unread input
+        reader, writer = await asyncio.open_connection(sock=socket.socket(fileno=fd), limit=self.stream_limit())
+        reader.feed_data(pending)
+        if session_id in self.connected or await self.session(session_id) is None:
+            writer.close()
+            return
+        self.connected.add(session_id)
+        await self.attach(session_id, reader, writer)
+
+    async def migrate(self, session_id):
+        conn = self.connections.get(session_id)
+        if conn is None: return False
+        if not conn.moving.done(): conn.moving.set_result(None)
+        return await conn.closed
+
+    async def drain(self):
+        # Hand every connected session back to the supervisor, e.g. before this worker is replaced
+        await asyncio.gather(*(self.migrate(session_id) for session_id in list(self.connections)))
+        socket.send_fds(self.control, [json.dumps({'op': 'drained'}).encode('utf-8')], [])
+
+def parse_args(argv):
+    options = {}
+    address = {}
+    stories = []
+    control_fd = None
+
+    args = iter(argv)
+    for arg in args:
+        if arg == '--host': address['host'] = next(args)
+        elif arg == '--port': address['port'] = int(next(args))
+        elif arg == '--unix': address['unix'] = next(args)
+        elif arg == '--story': stories.append(next(args))
+        elif arg == '--max-command': options['max_command'] = int(next(args))
+        elif arg == '--idle-timeout': options['idle_timeout'] = float(next(args))
+        elif arg == '--workers': options['workers'] = int(next(args))
+        elif arg == '--store': options['store'] = next(args)
+        elif arg == '--memory-budget': options['memory_budget'] = int(float(next(args)) * 1024 * 1024)
+        elif arg == '--hibernate-after': options['hibernate_after'] = float(next(args))
+        elif arg == '--checkpoint': options['checkpoint'] = float(next(args))
+        elif arg == '--story-budget': options['story_budget'] = int(float(next(args)) * 1024 * 1024)
+        elif arg == '--preload': options.setdefault('preload', []).append(next(args))
+        elif arg == '--subinterpreters': options['subinterpreters'] = True
+        elif arg == '--control-fd': control_fd = int(next(args))
+        else:
+            print("Usage: python src/server.py [--host HOST] [--port PORT | --unix PATH] [--story NAME]... "
+                  "[--max-command BYTES] [--idle-timeout SECONDS] [--workers N] "
+                  "[--store sessions.db] [--memory-budget MB] [--hibernate-after SECONDS] [--checkpoint SECONDS] "
+                  "[--story-budget MB] [--preload NAME]... [--subinterpreters]")
+            sys.exit(1)
+
+    missing = [s for s in stories if s not in available_stories()]
+    if missing:
+        print(f"Unknown stories: {', '.join(missing)}")
+        sys.exit(1)
+    return options, address, stories, control_fd
+
+def main(argv):
+    options, address, stories, control_fd = parse_args(argv)
+    try:
+        server = GameServer(stories, **options)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+    try:
+        if control_fd is not None: asyncio.run(server.serve_control(control_fd))
+        else: asyncio.run(server.serve(**address))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,247 @@
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Runs in each new interpreter; everything it knows arrives through prepare_main()
+BOOTSTRAP = """
+import sys
+if src_dir not in sys.path: sys.path.insert(0, src_dir)
+from subinterpreters import serve_story
+serve_story(requests, replies, story_id, workers)
+"""
+
+def load_interpreters():
+    # PEP 734: concurrent.interpreters, from Python 3.14. Its interpreters get their own GIL,
+    # so stories run on separate cores.
+    try:
+        from concurrent import interpreters
+        return interpreters
+    except ImportError:
+        raise RuntimeError(f"Subinterpreter mode needs Python 3.14 or newer (this is {sys.version.split()[0]})")
+
+def serve_story(requests, replies, story_id, workers):
+    # The interpreter side: one story template and its sessions, driven by JSON requests.
+    # A failing request (e.g. an author's condition blowing up or calling exit()) is answered with
+    # an error and affects neither the other sessions here nor any other story.
+    # Requests for one session run in order; different sessions' turns run side by side on a pool,
+    # so a slow AI fallback only delays its own player, as in the server's own executor.
+    from server import Session, load_runtime, load_story
+
+    runtime = load_runtime()
+    template = runtime['World'](load_story(story_id), story_id=story_id)
+    state_bytes = len(json.dumps(template.save_state_to_memory()))
+    sessions = {}
+    # Requests waiting per session; a session has an entry while a pool thread is working through it
+    backlog = {}
+    lock = threading.Lock()
+    writing = threading.Lock()
+    # The pipes belong to the host, which closes its copies once this function returns
+    inbox = os.fdopen(requests, 'r', encoding='utf-8', closefd=False)
+    outbox = os.fdopen(replies, 'w', encoding='utf-8', closefd=False)
+
+    def status(session, **reply):
+        return dict(reply, size=session.footprint(state_bytes), started=session.started, finished=session.finished)
+
+    def drain(session_id):
+        while True:
+            with lock:
+                if not backlog[session_id]:
+                    del backlog[session_id]
+                    return
+                request = backlog[session_id].popleft()
+            handle(request)
+
+    def handle(request):
+        op = request['op']
+        try:
+            if op == 'open':
+                session = sessions[request['session']] = Session(request['session'], template, runtime)
+                if request.get('snapshot') is not None: session.restore(request['snapshot'])
+                reply = status(session)
+            elif op == 'close':
+                sessions.pop(request['session'], None)
+                reply = {}
+            else:
+                session = sessions[request['session']]
+                if op == 'start': reply = status(session, output=session.start())
+                elif op == 'resume': reply = status(session, output=session.resume())
+                elif op == 'turn': reply = status(session, output=session.turn(request['line']))
+                elif op == 'snapshot': reply = {'snapshot': session.snapshot()}
+                else: reply = {'error': f"unknown request {op!r}"}
+        except BaseException as e:
+            # On a pool thread even exit() from an author's condition only fails this request
+            reply = {'error': f"{type(e).__name__}: {e}"}
+        reply['id'] = request['id']
+        with writing:
+            outbox.write(json.dumps(reply) + "\n")
+            outbox.flush()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"lore-lock-{story_id}") as pool:
+        for message in inbox:
+            request = json.loads(message)
+            with lock:
+                if request['session'] not in backlog:
+                    backlog[request['session']] = deque()
+                    pool.submit(drain, request['session'])
+                backlog[request['session']].append(request)
+
+class StoryInterpreter:
+    # One story in its own interpreter; requests and replies are JSON lines on a pair of pipes,
+    # which (unlike the interpreter queues) block without polling
+    def __init__(self, story_id, workers):
+        interpreters = load_interpreters()
+        self.story_id = story_id
+        requests, self.inbox = os.pipe()
+        self.outbox, replies = os.pipe()
+        self.ends = (requests, replies)
+        self.interp = interpreters.create()
+        self.interp.prepare_main(requests=requests, replies=replies, story_id=story_id, workers=workers, src_dir=SRC_DIR)
+        self.inbox = os.fdopen(self.inbox, 'w', encoding='utf-8')
+        self.outbox = os.fdopen(self.outbox, 'r', encoding='utf-8')
+        self.pending = {}
+        self.failure = None
+        self.stopped = False
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._writing = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name=f"lore-lock-story-{story_id}", daemon=True)
+        self.thread.start()
+        threading.Thread(target=self.dispatch, name=f"lore-lock-replies-{story_id}", daemon=True).start()
+
+    def run(self):
+        try:
+            self.interp.exec(BOOTSTRAP)
+        except Exception as e:
+            # e.g. SystemExit from an author's condition; the first line names the exception
+            self.failure = str(e).splitlines()[0]
+        finally:
+            for fd in self.ends: os.close(fd)
+
+    def dispatch(self):
+        # EOF on the replies pipe means the interpreter finished or died; waiters are released either way
+        for line in self.outbox:
+            reply = json.loads(line)
+            with self._lock: future = self.pending.pop(reply['id'], None)
+            if future: future.set_result(reply)
+        self.thread.join()
+        with self._lock:
+            self.stopped = True
+            waiting, self.pending = list(self.pending.values()), {}
+        error = f"story {self.story_id} stopped: {self.failure or 'closed'}"
+        for future in waiting: future.set_result({'error': error})
+
+    def alive(self):
+        return not self.stopped
+
+    def request(self, op, **fields):
+        future = Future()
+        with self._lock:
+            if self.stopped:
+                future.set_result({'error': f"story {self.story_id} stopped: {self.failure or 'closed'}"})
+                return future
+            request_id = next(self._ids)
+            self.pending[request_id] = future
+        # A full pipe blocks only writers; replies keep flowing meanwhile
+        with self._writing:
+            try:
+                self.inbox.write(json.dumps(dict(fields, op=op, id=request_id)) + "\n")
+                self.inbox.flush()
+            except OSError:
+                # The interpreter has gone; dispatch() answers the future once the replies pipe closes
+                pass
+        return future
+
+    def open(self, session_id, snapshot=None):
+        return RemoteSession(session_id, self, snapshot)
+
+    def call(self, op, **fields):
+        reply = self.request(op, **fields).result()
+        if 'error' in reply: raise RuntimeError(reply['error'])
+        return reply
+
+    def close(self):
+        # EOF on the requests pipe ends the interpreter's loop
+        with self._lock: self.stopped = True
+        with self._writing:
+            try: self.inbox.close()
+            except OSError: pass
+        self.thread.join()
+        self.interp.close()
+
+class StoryInterpreters:
+    # Stories started on first use, one interpreter each; one that died is replaced on the next open
+    def __init__(self, workers):
+        # Checked here so a server started without interpreter support fails at startup, not on the first player
+        load_interpreters()
+        self.workers = workers
+        self.stories = {}
+        self._lock = threading.Lock()
+
+    def get(self, story_id):
+        with self._lock:
+            story = self.stories.get(story_id)
+            if story is None or not story.alive():
+                if story is not None: story.close()
+                story = self.stories[story_id] = StoryInterpreter(story_id, self.workers)
+            return story
+
+    def preload(self, story_ids, executor):
+        return list(executor.map(self.get, story_ids))
+
+    def close(self):
+        with self._lock:
+            stories, self.stories = list(self.stories.values()), {}
+        for story in stories: story.close()
+
+class RemoteSession:
+    # Stands in for server.Session when the world lives in a story interpreter
+    remote = True
+
+    def __init__(self, session_id, story, snapshot=None):
+        self.id = session_id
+        self.story_id = story.story_id
+        self.story = story
+        self.busy = False
+        self.dirty = False
+        self.finished = False
+        self.resumed = False
+        self.size = 0
+        self.last_active = time.monotonic()
+        self.update(story.call('open', session=session_id, snapshot=snapshot))
+
+    def update(self, reply):
+        self.size = reply['size']
+        self._started = reply['started']
+        self.finished = reply['finished']
+        return reply
+
+    @property
+    def started(self):
+        return self.resumed or self._started
+
+    def footprint(self, state_bytes):
+        # Reported by the interpreter after every request
+        return self.size
+
+    def start(self):
+        return self.update(self.story.call('start', session=self.id))['output']
+
+    def resume(self):
+        return self.update(self.story.call('resume', session=self.id))['output']
+
+    def turn(self, line):
+        return self.update(self.story.call('turn', session=self.id, line=line))['output']
+
+    def snapshot(self):
+        return self.story.call('snapshot', session=self.id)['snapshot']
+
+    def close(self):
+        # Nobody waits for the answer; the loop thread must not block on the interpreter
+        self.story.request('close', session=self.id)
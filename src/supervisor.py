@@ -0,0 +1,458 @@
+import asyncio
+import bisect
+import gc
+import hashlib
+import json
+import os
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from server import GREETING, GameServer, SessionStore, StoryRegistry, available_stories, parse_args, parse_hello
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+
+class HashRing:
+    # Consistent hashing with virtual nodes: a session id always lands on the same worker slot
+    def __init__(self, slots, replicas=64):
+        self.points = sorted((self.hash(f"{slot}:{i}"), slot) for slot in slots for i in range(replicas))
+        self.keys = [point for point, _ in self.points]
+
+    @staticmethod
+    def hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def lookup(self, key):
+        return self.points[bisect.bisect(self.keys, self.hash(key)) % len(self.points)][1]
+
+class ForkServer:
+    # Fork mode: workers are forked by this helper, which the supervisor forks once, after preloading
+    # and before it starts any thread. A fork from the supervisor itself could copy a lock (stdio,
+    # malloc, imports) held by one of its listener, monitor or hand-off threads, locked for good.
+    def __init__(self, run_worker):
+        self.run_worker = run_worker
+        self.socket = None
+        self.lock = threading.Lock()
+
+    def start(self, inherited=()):
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if os.fork():
+            child.close()
+            self.socket = parent
+            return
+
+        code = 1
+        try:
+            parent.close()
+            for sock in inherited: sock.close()
+            # Signals are for the supervisor and the workers; this process ends when the supervisor's socket closes
+            for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP): signal.signal(signum, signal.SIG_IGN)
+            # Frozen objects are skipped by the workers' collections, so their pages stay shared
+            gc.freeze()
+            self.serve(child)
+            code = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(code)
+
+    def serve(self, control):
+        # One request at a time: fork a worker around the control socket that came with the request, or
+        # report whether a worker has exited. Workers are this process's children, so it reaps them.
+        exited = {}
+        while True:
+            msg, fds, _, _ = socket.recv_fds(control, 1024, 1)
+            if not msg: return
+            while True:
+                try: pid, status = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError: break
+                if not pid: break
+                exited[pid] = os.waitstatus_to_exitcode(status)
+            request = json.loads(msg)
+            if request['op'] == 'fork':
+                pid = os.fork()
+                if not pid:
+                    control.close()
+                    self.run_worker(socket.socket(fileno=fds[0]))
+                os.close(fds[0])
+                reply = {'pid': pid}
+            else:
+                reply = {'code': exited.pop(request['pid'], None)}
+            control.send(json.dumps(reply).encode('utf-8'))
+
+    def request(self, message, fds=()):
+        with self.lock:
+            socket.send_fds(self.socket, [json.dumps(message).encode('utf-8')], list(fds))
+            return json.loads(self.socket.recv(1024))
+
+    def fork(self, control):
+        return ForkedProcess(self.request({'op': 'fork'}, [control.fileno()])['pid'], self)
+
+    def poll(self, pid):
+        return self.request({'op': 'poll', 'pid': pid})['code']
+
+class ForkedProcess:
+    # Popen-like handle for a worker forked by the fork server
+    def __init__(self, pid, forks):
+        self.pid = pid
+        self.forks = forks
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None: self.returncode = self.forks.poll(self.pid)
+        return self.returncode
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() > deadline:
+                raise subprocess.TimeoutExpired(f"worker {self.pid}", timeout)
+            time.sleep(0.05)
+        return self.returncode
+
+    def kill(self):
+        os.kill(self.pid, signal.SIGKILL)
+
+class Worker:
+    # One server process; clients reach it as file descriptors sent over a SEQPACKET socket pair
+    def __init__(self, slot, args, on_message, fork=None):
+        self.slot = slot
+        self.args = args
+        self.on_message = on_message
+        self.fork = fork
+        self.process = None
+        self.control = None
+        self.restarts = 0
+        self.draining = False
+        self.drained = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        command = [sys.executable, SERVER, '--control-fd', str(child.fileno())] + self.args
+        with self.lock:
+            if self.control: self.control.close()
+            if self.fork: self.process = self.fork(child)
+            else: self.process = subprocess.Popen(command, pass_fds=(child.fileno(),))
+            self.control = parent
+        child.close()
+        threading.Thread(target=self.listen, args=(parent,), daemon=True).start()
+
+    def listen(self, control):
+        # Messages from the worker: migrated sessions (with their client socket) and drain notices
+        while True:
+            try: msg, fds, _, _ = socket.recv_fds(control, 65536, 1)
+            except OSError: return
+            if not msg: return
+            self.on_message(self, json.loads(msg), fds)
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def send(self, message, fds=()):
+        with self.lock:
+            socket.send_fds(self.control, [json.dumps(message).encode('utf-8')], list(fds))
+
+    def stop(self, timeout=10):
+        if not self.alive(): return
+        # Closing the control socket asks the worker to checkpoint and exit; shutdown() also wakes
+        # the listener thread, whose pending recv would otherwise keep the socket open
+        with self.lock:
+            self.control.shutdown(socket.SHUT_RDWR)
+            self.control.close()
+        try: self.process.wait(timeout)
+        except subprocess.TimeoutExpired: self.process.kill()
+
+class Handshake:
+    # A client between accept and its hello line
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.line = b""
+
+class Supervisor:
+    def __init__(self, processes=None, worker_args=(), stories=None, max_command=512, handshake_timeout=60, fork=False):
+        self.stories = stories or available_stories()
+        self.max_command = max_command
+        self.handshake_timeout = handshake_timeout
+        self.worker_args = list(worker_args)
+        self.registry = None
+        self.listener = None
+        self.forks = ForkServer(self.run_worker) if fork else None
+        fork = self.forks.fork if fork else None
+        self.workers = [Worker(slot, self.worker_args, self.on_message, fork) for slot in range(processes or os.cpu_count() or 1)]
+        self.ring = HashRing(range(len(self.workers)))
+        # Migrated sessions stay where they were moved to, overriding the ring, until that worker
+        # reports them released (hibernated or finished) or is replaced
+        self.placement = {}
+        self.moves = {}
+        self.migrations = 0
+        self.lifecycle = threading.Lock()
+        self.stopping = False
+        self.greeting = {}
+        # Only hand-offs run here; waiting for hello lines costs no thread
+        self.handshakes = ThreadPoolExecutor(max_workers=8, thread_name_prefix="lore-lock-handshake")
+
+    def route(self, session_id):
+        slot = self.placement.get(session_id)
+        worker = self.workers[self.ring.lookup(session_id) if slot is None else slot]
+        if worker.draining:
+            # New arrivals avoid a worker that is being replaced, and stay where they land
+            worker = self.workers[HashRing(w.slot for w in self.workers if not w.draining).lookup(session_id)]
+            self.placement[session_id] = worker.slot
+        return worker
+
+    def migrate(self, session_id, slot):
+        # The owning worker finishes the current turn, checkpoints and answers with 'migrated'
+        self.moves[session_id] = slot
+        self.route(session_id).send({'op': 'migrate', 'session': session_id})
+
+    def on_message(self, worker, message, fds):
+        if message.get('op') == 'migrated':
+            session_id = message['session']
+            slot = self.moves.pop(session_id, None)
+            if slot is None:
+                # Drained: the next worker on the ring without the departing one takes over
+                slot = HashRing(w.slot for w in self.workers if w is not worker).lookup(session_id)
+            self.placement[session_id] = slot
+            self.migrations += 1
+            try:
+                self.workers[slot].send({'op': 'adopt', 'session': session_id, 'pending': message['pending']}, fds)
+            except OSError as e:
+                print(f"Could not hand session {session_id} to worker {slot}: {e}", file=sys.stderr)
+            finally:
+                for fd in fds: os.close(fd)
+        elif message.get('op') == 'released':
+            if self.placement.get(message['session']) == worker.slot: del self.placement[message['session']]
+        elif message.get('op') == 'drained':
+            worker.drained.set()
+
+    def unpin(self, worker):
+        # A stopped worker holds no sessions; theirs are in the store for whichever worker the ring picks
+        for session_id in [s for s, slot in list(self.placement.items()) if slot == worker.slot]:
+            del self.placement[session_id]
+
+    def restart(self, worker, timeout=30):
+        # Zero-downtime replacement: live sessions move to other workers before the process is stopped
+        with self.lifecycle:
+            if len(self.workers) > 1 and worker.alive():
+                worker.draining = True
+                worker.drained.clear()
+                worker.send({'op': 'drain'})
+                worker.drained.wait(timeout)
+            worker.stop()
+            self.unpin(worker)
+            worker.restarts += 1
+            worker.start()
+            worker.draining = False
+
+    def restart_all(self):
+        for worker in self.workers: self.restart(worker)
+        print(f"Restarted {len(self.workers)} workers; {self.migrations} sessions migrated", file=sys.stderr)
+
+    def greet(self, selector):
+        try: conn, _ = self.listener.accept()
+        except BlockingIOError: return
+        conn.setblocking(False)
+        try:
+            # Fits in the empty send buffer of a new connection
+            conn.send(GREETING.format(", ".join(self.stories)).encode('utf-8'))
+        except OSError:
+            conn.close()
+            return
+        self.greeting[conn] = Handshake(time.monotonic() + self.handshake_timeout)
+        selector.register(conn, selectors.EVENT_READ)
+
+    def forget(self, selector, conn):
+        selector.unregister(conn)
+        del self.greeting[conn]
+
+    def receive(self, selector, conn):
+        # Reads up to the end of the hello line and no further: anything typed after it stays in
+        # the socket for the worker
+        shake = self.greeting[conn]
+        try:
+            data = conn.recv(self.max_command + 1, socket.MSG_PEEK)
+            end = data.find(b"\n")
+            if data: data = conn.recv(end + 1 if end >= 0 else len(data))
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        shake.line += data
+        if not data or len(shake.line) > self.max_command:
+            self.forget(selector, conn)
+            conn.close()
+            return
+        if not shake.line.endswith(b"\n"): return
+
+        line, shake.line = shake.line.decode('utf-8', 'replace'), b""
+        request = parse_hello(line, self.stories)
+        if request is None and line.split() != ['quit']:
+            try:
+                conn.send(b"Unknown story.\n> ")
+                return
+            except OSError:
+                pass
+        self.forget(selector, conn)
+        if request is None:
+            conn.close()
+            return
+        story_id, session_id = request
+        conn.setblocking(True)
+        self.handshakes.submit(self.hand_off, conn, f"play {story_id} {session_id}\n", session_id)
+
+    def expire(self, selector):
+        now = time.monotonic()
+        for conn in [c for c, shake in self.greeting.items() if shake.deadline <= now]:
+            self.forget(selector, conn)
+            conn.close()
+        return min((shake.deadline for shake in self.greeting.values()), default=now + 60) - now
+
+    def hand_off(self, conn, hello, session_id):
+        try:
+            self.dispatch(conn, hello, session_id)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def dispatch(self, conn, hello, session_id):
+        # Sticky: the ring maps a session to one slot, and a crashed slot is restarted in place
+        worker = self.route(session_id)
+        for _ in range(20):
+            try:
+                worker.send({'op': 'connect', 'hello': hello}, [conn.fileno()])
+                return
+            except OSError:
+                time.sleep(0.5)
+        conn.sendall(b"Server busy; please reconnect.\n")
+
+    def preload(self):
+        # Fork mode: the runtime and hot stories are loaded once here and inherited by the fork server,
+        # and through it by every worker. The collector stays off until the fork server has been
+        # forked, so no freed holes are left in the pages it shares.
+        gc.disable()
+        options, _, stories, _ = parse_args(self.worker_args)
+        self.registry = StoryRegistry(options['story_budget']) if 'story_budget' in options else StoryRegistry()
+        hot = options.get('preload') or stories
+        if not hot:
+            store = SessionStore(options.get('store', 'sessions.db'))
+            hot = [s for s in store.popular(options.get('preload_count', 4)) if s in self.stories]
+            store.close()
+        started = time.perf_counter()
+        self.registry.runtime
+        for story_id in hot: self.registry.template(story_id)
+        print(f"Preloaded runtime and {len(hot)} stories in {(time.perf_counter() - started) * 1000:.0f}ms", file=sys.stderr)
+        self.forks.start(inherited=[self.listener])
+        gc.enable()
+
+    def run_worker(self, control):
+        # Runs in a child of the fork server, which has already closed the listener
+        code = 1
+        try:
+            gc.enable()
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+            options, _, stories, _ = parse_args(self.worker_args)
+            server = GameServer(stories, registry=self.registry, **options)
+            asyncio.run(server.serve_control(control.detach()))
+            code = 0
+        except KeyboardInterrupt:
+            code = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(code)
+
+    def monitor(self, interval=0.5):
+        while not self.stopping:
+            for worker in self.workers:
+                with self.lifecycle:
+                    if not self.stopping and not worker.alive():
+                        print(f"Worker {worker.slot} exited with code {worker.process.returncode}; restarting", file=sys.stderr)
+                        self.unpin(worker)
+                        worker.restarts += 1
+                        worker.start()
+            time.sleep(interval)
+
+    def serve(self, host='127.0.0.1', port=4000, unix=None):
+        if unix:
+            if os.path.exists(unix): os.remove(unix)
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(unix)
+        else:
+            listener = socket.create_server((host, port))
+        listener.listen(128)
+        listener.setblocking(False)
+        self.listener = listener
+
+        if self.forks: self.preload()
+
+        for worker in self.workers: worker.start()
+        threading.Thread(target=self.monitor, daemon=True).start()
+        print(f"Supervising {len(self.workers)} workers on {unix or listener.getsockname()}")
+
+        # Greetings and hello lines for every waiting client share one selector, so clients that
+        # connect and say nothing only hold a socket until their handshake times out
+        selector = selectors.DefaultSelector()
+        selector.register(listener, selectors.EVENT_READ)
+        try:
+            while True:
+                for key, _ in selector.select(max(0, self.expire(selector))):
+                    if key.fileobj is listener: self.greet(selector)
+                    else: self.receive(selector, key.fileobj)
+        finally:
+            self.stopping = True
+            for conn in list(self.greeting): conn.close()
+            selector.close()
+            listener.close()
+            for worker in self.workers: worker.stop()
+
+def main(argv):
+    address = {}
+    options = {}
+    worker_args = []
+    stories = []
+
+    args = iter(argv)
+    for arg in args:
+        if arg == '--host': address['host'] = next(args)
+        elif arg == '--port': address['port'] = int(next(args))
+        elif arg == '--unix': address['unix'] = next(args)
+        elif arg == '--processes': options['processes'] = int(next(args))
+        elif arg == '--fork': options['fork'] = True
+        elif arg == '--subinterpreters': worker_args.append(arg)
+        elif arg.startswith('--'):
+            # Everything else configures the workers (see src/server.py)
+            value = next(args)
+            worker_args += [arg, value]
+            if arg == '--story': stories.append(value)
+            if arg == '--max-command': options['max_command'] = int(value)
+        else:
+            print("Usage: python src/supervisor.py [--host HOST] [--port PORT | --unix PATH] [--processes N] [--fork] [server options]")
+            sys.exit(1)
+
+    # Workers checkpoint resident sessions so a crash loses at most a few seconds of play
+    if '--checkpoint' not in worker_args: worker_args += ['--checkpoint', '5']
+
+    supervisor = Supervisor(worker_args=worker_args, stories=stories, **options)
+    # SIGTERM (e.g. from a service manager) shuts the workers down cleanly, like Ctrl-C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    # SIGHUP replaces the workers one at a time (e.g. after a deploy) without dropping players
+    signal.signal(signal.SIGHUP, lambda *_: threading.Thread(target=supervisor.restart_all, daemon=True).start())
+    try:
+        supervisor.serve(**address)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
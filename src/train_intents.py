@@ -0,0 +1,99 @@
+import json
+import os
+import sqlite3
+import sys
+import yaml
+
+from compiler import generate_game_code
+
+CASSETTE_DIR = 'stories/cassettes'
+MODEL_DIR = 'stories/intents'
+
+def load_runtime(yaml_file):
+    with open(yaml_file, 'r') as f:
+        data = yaml.safe_load(f)
+    story_id = os.path.splitext(os.path.basename(yaml_file))[0]
+    namespace = {}
+    exec(generate_game_code(data, story_id), namespace)
+    return story_id, namespace
+
+def load_dm_config():
+    if not os.path.exists('dm_config.yaml'): return {}
+    with open('dm_config.yaml', 'r') as f:
+        return yaml.safe_load(f) or {}
+
+def top_command(entry):
+    commands = entry.get('commands') or [entry.get('command')]
+    return commands[0] if commands and commands[0] else None
+
+def collect_pairs(story_id, logs, caches):
+    pairs = []
+
+    cassette = os.path.join(CASSETTE_DIR, story_id + ".json")
+    if os.path.exists(cassette):
+        with open(cassette, 'r') as f:
+            for entry in json.load(f).values():
+                if top_command(entry): pairs.append((entry['input'], top_command(entry)))
+
+    for log in logs:
+        if not os.path.exists(log): continue
+        with open(log, 'r') as f:
+            for line in f:
+                try: entry = json.loads(line)
+                except ValueError: continue
+                if entry.get('story') == story_id and top_command(entry):
+                    pairs.append((entry['input'], top_command(entry)))
+
+    for cache in caches:
+        if not os.path.exists(cache): continue
+        db = sqlite3.connect(cache)
+        try:
+            rows = db.execute("SELECT key, commands FROM candidates WHERE key LIKE ?", (story_id + "|%",)).fetchall()
+        except sqlite3.Error:
+            rows = []
+        finally:
+            db.close()
+        for key, commands in rows:
+            commands = json.loads(commands)
+            if commands: pairs.append((key.split("|")[1], commands[0]))
+
+    return pairs
+
+def train_story(yaml_file, logs, caches):
+    story_id, namespace = load_runtime(yaml_file)
+    pairs = collect_pairs(story_id, logs, caches)
+    if not pairs:
+        print(f"Skipping {story_id}: no logged AI mappings.")
+        return
+
+    model = namespace['IntentClassifier'].train(pairs)
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    model_filename = os.path.join(MODEL_DIR, story_id + ".json")
+    with open(model_filename, 'w') as f:
+        json.dump(model, f, indent=1, sort_keys=True)
+    print(f"Trained {model_filename}: {model['examples']} examples, {len(model['classes'])} templates")
+
+def main(argv):
+    config = load_dm_config()
+    logs = [config['mapping_log']] if config.get('mapping_log') else []
+    caches = [config['cache_path']] if config.get('cache_path') else []
+    targets = []
+
+    args = iter(argv)
+    for arg in args:
+        if arg == '--log': logs.append(next(args))
+        elif arg == '--cache': caches.append(next(args))
+        elif arg == '--all':
+            story_dir = 'stories/yaml'
+            targets.extend(os.path.join(story_dir, f) for f in sorted(os.listdir(story_dir)) if f.endswith(".yaml"))
+        else: targets.append(arg)
+
+    if not targets:
+        print("Usage: python src/train_intents.py <story.yaml>... | --all [--log mappings.jsonl] [--cache cache.db]")
+        sys.exit(1)
+
+    for yaml_file in targets:
+        train_story(yaml_file, logs, caches)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,11 +1,48 @@
 
+import time
+_STARTED = time.perf_counter()
+
 import sys
-import json
 import os
-import urllib.request
-import urllib.error
-import re
-import random
+import threading
+import importlib
+from collections import OrderedDict, deque
+
+# ==========================================
+# LAZY IMPORTS
+# ==========================================
+IMPORT_TIMES = []
+
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            started = time.perf_counter()
+            self._module = importlib.import_module(self._name)
+            IMPORT_TIMES.append((self._name, time.perf_counter() - started))
+        return getattr(self._module, attr)
+
+# Networking, hashing and serialization are only imported when a turn first needs them
+json = LazyModule('json')
+hashlib = LazyModule('hashlib')
+random = LazyModule('random')
+http_client = LazyModule('http.client')
+urllib_parse = LazyModule('urllib.parse')
+futures = LazyModule('concurrent.futures')
+sqlite3 = LazyModule('sqlite3')
+math = LazyModule('math')
+yaml = LazyModule('yaml')
+
+def startup_report(first_prompt=None, since=0):
+    # Same layout as python -X importtime, limited to the lazily imported subsystems
+    lines = []
+    if first_prompt is not None: lines.append(f"startup: {first_prompt * 1000:.1f} ms to first prompt")
+    for name, seconds in IMPORT_TIMES[since:]:
+        lines.append(f"import time: {int(seconds * 1e6):>9} | {name}")
+    return "\n".join(lines)
 
 # Data injected by compiler
 GAME_DATA = {'title': 'Door Test', 'purpose': 'Test door functionality: locking, unlocking with keys, opening, closing, and bidirectional travel.', 'scenes': [{'id': 'Hall', 'name': 'Hallway', 'contents': [{'id': 'brass key', 'name': 'brass key'}], 'exits': {'east': {'target': 'Bedroom', 'door': 'oak door'}}}, {'id': 'Bedroom', 'name': 'Master Bedroom'}], 'doors': [{'id': 'oak door', 'name': 'oak door', 'locked': True, 'key': 'brass key'}], 'start_room': 'Hall', 'test_sequence': ['east', 'take brass key', 'unlock oak door with brass key', 'open oak door', 'east', 'look'], 'win_condition': {'type': 'location', 'target': 'Bedroom'}}
@@ -16,57 +53,570 @@ DM_CONFIG_FILE = "dm_config.yaml"
 # ==========================================
 # GAME IO
 # ==========================================
-class GameIO:
+class StdoutSink:
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def emit(self, text):
+        stream = self.stream or sys.stdout
+        stream.write(text)
+        stream.flush()
+
+class MemorySink:
     def __init__(self):
-        self.history = []
+        self.chunks = []
+
+    def emit(self, text):
+        self.chunks.append(text)
+
+    def drain(self):
+        text = "".join(self.chunks)
+        self.chunks = []
+        return text
+
+class FileSink:
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def emit(self, text):
+        if self._file is None: self._file = open(self.path, 'a')
+        self._file.write(text)
+        self._file.flush()
+
+    def close(self):
+        if self._file: self._file.close()
+
+class SocketSink:
+    def __init__(self, sock, encoding='utf-8'):
+        self.sock = sock
+        self.encoding = encoding
+
+    def emit(self, text):
+        self.sock.sendall(text.encode(self.encoding))
+
+class GameIO:
+    def __init__(self, sink=None, history_turns=3, history_bytes=1024):
+        self.sink = sink or StdoutSink()
+        self.history = deque(maxlen=history_turns)
+        self.history_bytes = history_bytes
+        self._history_str = None
         self.last_input = None
         self.current_turn_output = []
+        self.buffer = []
 
     def write(self, message):
-        print(message)
-        self.current_turn_output.append(str(message))
+        # Buffered until flush() so a turn reaches the sink as a single write
+        message = str(message)
+        self.buffer.append(message)
+        self.current_turn_output.append(message)
+
+    def flush(self):
+        if not self.buffer: return
+        text = "\n".join(self.buffer) + "\n"
+        self.buffer = []
+        self.sink.emit(text)
 
     def log_input(self, text):
         if self.last_input is not None:
-             self.history = ["User: " + self.last_input, "System: " + " ".join(self.current_turn_output)]
+            turn = "User: " + self.last_input + "\nSystem: " + " ".join(self.current_turn_output)
+            self.history.append(self._clip(turn))
+            self._history_str = None
 
         self.last_input = text
         self.current_turn_output = []
 
+    def _clip(self, turn):
+        data = turn.encode('utf-8')
+        if len(data) <= self.history_bytes: return turn
+        return data[:self.history_bytes].decode('utf-8', 'ignore')
+
+    def set_history_limits(self, turns=None, max_bytes=None):
+        # Resizes the ring (keeping the newest turns) and re-clips what it holds
+        if max_bytes is not None: self.history_bytes = max_bytes
+        self.history = deque((self._clip(t) for t in self.history), maxlen=turns or self.history.maxlen)
+        self._history_str = None
+
+    def to_state(self):
+        return {'history': list(self.history), 'history_turns': self.history.maxlen, 'history_bytes': self.history_bytes,
+                'last_input': self.last_input, 'turn_output': self.current_turn_output[:]}
+
+    def load_state(self, state):
+        # The limits travel with the turns, so a fresh world that has not configured its own keeps them all
+        self.history_bytes = state.get('history_bytes', self.history_bytes)
+        self.history = deque(state.get('history', []), maxlen=state.get('history_turns', self.history.maxlen))
+        self._history_str = None
+        self.last_input = state.get('last_input')
+        self.current_turn_output = state.get('turn_output', [])[:]
+
     def get_history_str(self):
-        return "\n".join(self.history)
+        # Joined once per turn; the oldest turns are dropped first to stay under the byte cap
+        if self._history_str is None:
+            parts, size = [], 0
+            for turn in reversed(self.history):
+                size += len(turn.encode('utf-8')) + (1 if parts else 0)
+                if size > self.history_bytes: break
+                parts.append(turn)
+            self._history_str = "\n".join(reversed(parts))
+        return self._history_str
 
 # ==========================================
 # AI CLIENT
 # ==========================================
-class AIClient:
+class Cassette:
+    def __init__(self, path, mode='replay'):
+        self.path = path
+        self.mode = mode
+        self._entries = None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = {}
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f: self._entries = json.load(f)
+        return self._entries
+
+    @staticmethod
+    def fingerprint(user_input, valid_commands, history, context):
+        blob = json.dumps([user_input.lower().strip(), sorted(valid_commands), context, history])
+        return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+    def lookup(self, key):
+        return self.entries.get(key)
+
+    def record(self, key, user_input, commands):
+        self.entries[key] = {'input': user_input, 'commands': commands}
+        folder = os.path.dirname(self.path)
+        if folder: os.makedirs(folder, exist_ok=True)
+        with open(self.path, 'w') as f: json.dump(self.entries, f, indent=2, sort_keys=True)
+
+class ResponseCache:
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, size=256, path=None):
+        self.size = size
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, size=256, path=None):
+        # One cache per configuration, shared by every session in the process
+        with cls._shared_lock:
+            if (size, path) not in cls._shared:
+                cls._shared[(size, path)] = cls(size, path)
+            return cls._shared[(size, path)]
+
+    @staticmethod
+    def key(story, user_input, valid_commands, context):
+        digest = hashlib.sha256(json.dumps([context, sorted(valid_commands)]).encode('utf-8')).hexdigest()
+        return story + "|" + " ".join(user_input.lower().split()) + "|" + digest
+
+    def get(self, key):
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key]
+            if self.path:
+                try:
+                    row = self._store().execute("SELECT commands FROM candidates WHERE key = ?", (key,)).fetchone()
+                except Exception:
+                    row = None
+                if row:
+                    self._remember(key, json.loads(row[0]))
+                    self.hits += 1
+                    return True, self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, commands):
+        with self._lock:
+            self._remember(key, commands)
+            if self.path:
+                try:
+                    db = self._store()
+                    db.execute("INSERT OR REPLACE INTO candidates (key, commands) VALUES (?, ?)", (key, json.dumps(commands)))
+                    db.commit()
+                except Exception as e:
+                    print(f"Warning: Could not write AI cache: {e}")
+
+    def _remember(self, key, commands):
+        self.entries[key] = commands
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def _store(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS candidates (key TEXT PRIMARY KEY, commands TEXT)")
+        return self._db
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+class AIError(Exception):
+    pass
+
+class HTTPTransport:
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, base_url, connect_timeout=5, read_timeout=30, retries=2, backoff=0.5, pool_size=4):
+        parts = urllib_parse.urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, base_url, **options):
+        # Keep-alive connections are pooled per endpoint across all sessions in the process
+        key = (base_url, tuple(sorted(options.items())))
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(base_url, **options)
+            return cls._shared[key]
+
+    def _connect(self, deadline):
+        conn_cls = http_client.HTTPSConnection if self.scheme == 'https' else http_client.HTTPConnection
+        conn = conn_cls(self.host, self.port, timeout=self._remaining(deadline, self.connect_timeout))
+        conn.connect()
+        return conn
+
+    def _acquire(self, deadline):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        reused = conn is not None
+        if not reused: conn = self._connect(deadline)
+        if conn.sock: conn.sock.settimeout(self._remaining(deadline, self.read_timeout))
+        return conn, reused
+
+    @staticmethod
+    def _remaining(deadline, limit):
+        if deadline is None: return limit
+        left = deadline - time.monotonic()
+        if left <= 0: raise AIError("Deadline exceeded")
+        return min(limit, left)
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle: conn.close()
+
+    def post_json(self, path, payload, headers, deadline=None):
+        conn, response, data = self._send(path, payload, headers, deadline)
+        return json.loads(data.decode('utf-8'))
+
+    def stream_events(self, path, payload, headers, deadline=None):
+        # Yields server-sent event payloads; closing the generator early drops the connection
+        conn, response, _ = self._send(path, payload, dict(headers, Accept="text/event-stream"), deadline, stream=True)
+        done = False
+        try:
+            for line in response:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise AIError("Deadline exceeded")
+                line = line.strip()
+                if not line.startswith(b"data:"): continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    done = True
+                    break
+                yield json.loads(data.decode('utf-8'))
+        except (OSError, http_client.HTTPException) as e:
+            raise AIError(f"Stream failed: {e}")
+        finally:
+            if done and not response.will_close:
+                response.read()
+                self._release(conn)
+            else:
+                conn.close()
+
+    def _send(self, path, payload, headers, deadline, stream=False):
+        body = json.dumps(payload).encode('utf-8')
+        headers = dict(headers, **{"Content-Type": "application/json", "Connection": "keep-alive"})
+        attempt = 0
+        while True:
+            conn, reused = None, False
+            try:
+                conn, reused = self._acquire(deadline)
+                conn.request("POST", self.base_path + path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = None if stream and response.status < 400 else response.read()
+            except (OSError, http_client.HTTPException) as e:
+                if conn: conn.close()
+                # A pooled connection the server already dropped is retried at once on a fresh socket
+                if reused: continue
+                if attempt >= self.retries: raise AIError(f"Request failed: {e}")
+            else:
+                if data is None: return conn, response, None
+                if response.will_close: conn.close()
+                else: self._release(conn)
+                if response.status < 400:
+                    return conn, response, data
+                if response.status not in self.RETRY_STATUSES or attempt >= self.retries:
+                    raise AIError(f"HTTP {response.status}: {data[:200]!r}")
+            delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise AIError("Deadline exceeded")
+            time.sleep(delay)
+            attempt += 1
+
+class CircuitBreaker:
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, threshold=3, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, name, **options):
+        # Sessions talking to the same endpoint trip and recover together
+        with cls._shared_lock:
+            if name not in cls._shared:
+                cls._shared[name] = cls(**options)
+            return cls._shared[name]
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.cooldown: return False
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                # Only one probe request goes through until it succeeds or fails
+                if self._probing: return False
+                self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def release(self):
+        # A caller that never reached the endpoint gives back its half-open probe without a verdict
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == 'half_open' or self.failures >= self.threshold:
+                if self.state != 'open': self.trips += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            retry_in = 0
+            if self.state == 'open':
+                retry_in = max(0, self.cooldown - (time.monotonic() - self.opened_at))
+            return {'state': self.state, 'failures': self.failures, 'trips': self.trips, 'retry_in': round(retry_in, 3)}
+
+class AIScheduler:
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, max_concurrency=4, rate=0, burst=None):
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst or max_concurrency
+        self.tokens = float(self.burst)
+        self.refilled = time.monotonic()
+        self.active = 0
+        self.queues = OrderedDict()
+        self.inflight = {}
+        self.upstream = 0
+        self.coalesced = 0
+        self._cond = threading.Condition()
+
+    @classmethod
+    def shared(cls, **options):
+        with cls._instance_lock:
+            if cls._instance is None: cls._instance = cls(**options)
+            return cls._instance
+
+    def submit(self, session, key, fn, deadline=None):
+        with self._cond:
+            flight = self.inflight.get(key)
+            owner = flight is None
+            if owner: flight = self.inflight[key] = futures.Future()
+            else: self.coalesced += 1
+
+        # Identical in-flight requests wait for the owner's upstream call instead of making their own
+        if not owner:
+            return flight.result(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+
+        try:
+            self._acquire(session, deadline)
+            try:
+                result = fn()
+            finally:
+                self._release()
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            with self._cond: self.inflight.pop(key, None)
+
+    def _acquire(self, session, deadline):
+        ticket = object()
+        with self._cond:
+            self.queues.setdefault(session, deque()).append(ticket)
+            while True:
+                wait = None
+                if self._is_next(ticket) and self.active < self.max_concurrency:
+                    wait = self._take_token()
+                    if wait == 0: break
+                if deadline is not None:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        self._dequeue(session, ticket)
+                        self._cond.notify_all()
+                        raise AIError("Deadline exceeded while queued")
+                    wait = left if wait is None else min(wait, left)
+                self._cond.wait(wait)
+            self._dequeue(session, ticket)
+            self.active += 1
+            self.upstream += 1
+            # Another slot may still be free for whoever is now next in line
+            self._cond.notify_all()
+
+    def _is_next(self, ticket):
+        # Sessions take turns: only the head request of the session at the front of the rotation may start
+        session = next(iter(self.queues))
+        return self.queues[session][0] is ticket
+
+    def _dequeue(self, session, ticket):
+        queue = self.queues[session]
+        queue.remove(ticket)
+        if queue: self.queues.move_to_end(session)
+        else: del self.queues[session]
+
+    def _take_token(self):
+        if not self.rate: return 0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def _release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'active': self.active,
+                'queued': sum(len(q) for q in self.queues.values()),
+                'upstream': self.upstream,
+                'coalesced': self.coalesced
+            }
+
+class AIConfig:
+    _instances = {}
+    _instances_lock = threading.Lock()
+
     def __init__(self, config_file):
+        self.config_file = config_file
+        self.reload = os.environ.get("LORE_LOCK_CONFIG_RELOAD", "") not in ("", "0")
+        self.values = {}
         self.enabled = False
-        self.config = {}
+        self.api_key = None
+        self.version = 0
+        self._stamp = None
+        self._next_check = 0
+        self._env_keys = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, config_file):
+        with cls._instances_lock:
+            if config_file not in cls._instances:
+                cls._instances[config_file] = cls(config_file)
+            return cls._instances[config_file]
+
+    def ensure(self):
+        with self._lock:
+            if not self.version:
+                self._load()
+            elif (self.reload or self.values.get('reload_config')) and time.monotonic() >= self._next_check:
+                # Optional reload: files are re-stat'ed at most once a second
+                self._next_check = time.monotonic() + 1
+                if self._mtimes() != self._stamp: self._load()
+        return self
+
+    def _find_file(self, filename):
+        if os.path.exists(filename): return filename
+        path = filename
+        for _ in range(3):
+            path = os.path.join("..", path)
+            if os.path.exists(path): return path
+        return None
+
+    def _mtimes(self):
+        stamp = []
+        for name in (".env", self.config_file):
+            path = self._find_file(name)
+            stamp.append((path, os.path.getmtime(path) if path else None))
+        return stamp
+
+    def _load(self):
+        self._stamp = self._mtimes()
         self._load_env()
         self.api_key = os.environ.get("OPENAI_API_KEY")
+        self.values = {}
+        self.enabled = False
 
-        config_path = self._find_file(config_file)
+        config_path = self._find_file(self.config_file)
         if self.api_key and config_path:
             try:
-                import yaml
                 with open(config_path, 'r') as f:
-                    self.config = yaml.safe_load(f)
+                    self.values = yaml.safe_load(f) or {}
                 self.enabled = True
             except ImportError:
                 print("Warning: PyYAML not installed, AI features disabled.")
             except Exception as e:
                 print(f"Warning: Could not load DM config: {e}")
-        elif not self.api_key:
-            pass
-
-    def _find_file(self, filename):
-        if os.path.exists(filename): return filename
-        path = filename
-        for _ in range(3):
-            path = os.path.join("..", path)
-            if os.path.exists(path): return path
-        return None
+        self.version += 1
 
     def _load_env(self):
         env_path = self._find_file(".env")
@@ -79,31 +629,213 @@ class AIClient:
                         if "=" in line:
                             key, val = line.split("=", 1)
                             key = key.strip()
-                            if key not in os.environ:
+                            # Values this loader set earlier may be refreshed on reload; real environment wins
+                            if key not in os.environ or self._env_keys.get(key) == os.environ[key]:
                                 os.environ[key] = val.strip()
+                                self._env_keys[key] = val.strip()
             except Exception as e:
                 print(f"Warning: Failed to load .env: {e}")
 
-    def map_command(self, user_input, valid_commands, history, context):
-        if not self.enabled: return None
+class AIClient:
+    _executor = None
+    _executor_lock = threading.Lock()
+    _log_lock = threading.Lock()
+
+    def __init__(self, config_file, cassette=None, cassette_mode=None):
+        # Per-session state only; configuration is loaded once per process on first use
+        self.config_file = config_file
+        self._cassette_args = (cassette, cassette_mode)
+        self._bound = None
+        self.session = None
+        self.story = STORY_ID
+        self.early_stops = 0
+        self.requests = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_error = None
+        self.latencies = deque(maxlen=100)
+        self.catalog = None
+        self.prefix_hashes = {}
+
+    def _settings(self):
+        settings = AIConfig.get(self.config_file).ensure()
+        if self._bound != settings.version:
+            self._bound = settings.version
+            self._wire(settings.values)
+        return settings
+
+    def _wire(self, config):
+        # Cassette: 'record' stores live responses, 'replay' answers from the file without network access
+        cassette, cassette_mode = self._cassette_args
+        cassette = cassette or os.environ.get("LORE_LOCK_CASSETTE") or config.get('cassette')
+        cassette_mode = cassette_mode or os.environ.get("LORE_LOCK_CASSETTE_MODE") or config.get('cassette_mode', 'replay')
+        self.cassette = Cassette(cassette, cassette_mode) if cassette else None
+        self.cache = ResponseCache.shared(config.get('cache_size', 256), config.get('cache_path'))
+        self.scheduler = AIScheduler.shared(
+            max_concurrency=config.get('max_concurrent_requests', 4),
+            rate=config.get('requests_per_second', 0)
+        )
+        base_url = os.environ.get("OPENAI_BASE_URL") or config.get('base_url', "https://api.openai.com/v1")
+        self.transport = HTTPTransport.shared(
+            base_url,
+            connect_timeout=config.get('connect_timeout', 5),
+            read_timeout=config.get('read_timeout', 30),
+            retries=config.get('max_retries', 2)
+        )
+        self.breaker = CircuitBreaker.shared(
+            base_url,
+            threshold=config.get('breaker_threshold', 3),
+            cooldown=config.get('breaker_cooldown', 30)
+        )
+
+    @property
+    def config(self): return self._settings().values
+
+    @property
+    def enabled(self): return self._settings().enabled
+
+    @property
+    def api_key(self): return self._settings().api_key
+
+    @property
+    def speculative(self): return bool(self.config.get('speculative', False))
+
+    @property
+    def n_best(self): return self.config.get('n_best', 3)
+
+    @property
+    def stream(self): return bool(self.config.get('stream', False))
+
+    @property
+    def turn_budget(self): return self.config.get('turn_budget', 8)
+
+    @classmethod
+    def _get_executor(cls):
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="ai-fallback")
+            return cls._executor
+
+    def deadline(self):
+        return time.monotonic() + self.turn_budget
+
+    def prefetch(self, user_input, valid_commands, history, context, deadline=None):
+        # Starts map_candidates on a worker thread so the request overlaps local parsing
+        if not self._settings().enabled and not self.cassette: return None
+        return self._get_executor().submit(self.map_candidates, user_input, valid_commands, history, context, deadline)
+
+    def stats(self):
+        self._settings()
+        latencies = sorted(self.latencies)
+        return {
+            'breaker': self.breaker.stats(),
+            'requests': self.requests,
+            'failures': self.failures,
+            'skipped': self.skipped,
+            'early_stops': self.early_stops,
+            'last_error': self.last_error,
+            'last_latency': round(self.latencies[-1], 3) if latencies else None,
+            'p50_latency': round(latencies[len(latencies) // 2], 3) if latencies else None,
+            'max_latency': round(latencies[-1], 3) if latencies else None,
+            'cache': self.cache.stats(),
+            'scheduler': self.scheduler.stats(),
+            'prefix_hashes': dict(self.prefix_hashes)
+        }
 
-        system_prompt = self.config.get('system_prompt', "You are a helpful AI.")
-        model = self.config.get('model', 'gpt-5-nano')
-        temperature = self.config.get('temperature', 1)
+    def map_command(self, user_input, valid_commands, history, context, deadline=None):
+        candidates = self.map_candidates(user_input, valid_commands, history, context, deadline)
+        return candidates[0] if candidates else None
+
+    def map_candidates(self, user_input, valid_commands, history, context, deadline=None):
+        settings = self._settings()
+        key = None
+        if self.cassette:
+            key = Cassette.fingerprint(user_input, valid_commands, history, context)
+            if self.cassette.mode == 'replay':
+                entry = self.cassette.lookup(key) or {}
+                if 'commands' in entry: return entry['commands']
+                return [entry['command']] if entry.get('command') else []
+
+        if not settings.enabled: return []
+
+        cache_key = ResponseCache.key(self.story, user_input, valid_commands, context)
+        hit, candidates = self.cache.get(cache_key)
+        if not hit:
+            # An open breaker answers immediately instead of waiting on a failing endpoint
+            if not self.breaker.allow():
+                self.skipped += 1
+                return []
+            self.requests += 1
+            started = time.monotonic()
+            deadline = deadline or self.deadline()
+            upstream = []
+
+            def call():
+                # Only the request that goes upstream judges the endpoint; coalesced waiters share its
+                # outcome, and a deadline hit while queued says nothing about the endpoint
+                upstream.append(True)
+                try:
+                    result = self._request(user_input, valid_commands, history, context, deadline)
+                except Exception:
+                    self.breaker.record_failure()
+                    raise
+                self.breaker.record_success()
+                return result
+
+            try:
+                candidates = self.scheduler.submit(self.session or id(self), cache_key, call, deadline)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                if not upstream: self.breaker.release()
+                return []
+            finally:
+                self.latencies.append(time.monotonic() - started)
+            if candidates:
+                self.cache.put(cache_key, candidates)
+                self._log_mapping(user_input, candidates)
+
+        if key: self.cassette.record(key, user_input, candidates)
+        return candidates
+
+    def _log_mapping(self, user_input, candidates):
+        # Logged pairs are the training data for src/train_intents.py
+        path = self.config.get('mapping_log')
+        if not path: return
+        line = json.dumps({'story': self.story, 'input': user_input, 'commands': candidates})
+        try:
+            with self._log_lock:
+                with open(path, 'a') as f: f.write(line + "\n")
+        except Exception as e:
+            print(f"Warning: Could not write AI mapping log: {e}")
 
-        valid_cmds_str = "\n".join([f"- {cmd}" for cmd in valid_commands])
+    def build_messages(self, user_input, valid_commands, history, context):
+        # Static prefix first (byte-identical for every request of a story) so provider prompt caching applies
+        system_prompt = self.config.get('system_prompt', "You are a helpful AI.")
+        catalog = "\n".join([f"- {cmd}" for cmd in sorted(self.catalog or valid_commands)])
+        prefix = f"{system_prompt}\n\nTranslate the user's natural language into one of these standard formats:\n{catalog}\n\n"
+        prefix += f'Respond with JSON of the form {{"commands": ["<best command>", ...]}} listing up to {self.n_best} candidate commands, most likely first.'
 
-        prompt = f"Translate the user's natural language into one of these standard formats:\n{valid_cmds_str}\n\n"
-        prompt += f"Current Location Context:\n{context}\n\n"
-        prompt += f"Recent History:\n{history}\n"
+        digest = hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:16]
+        self.prefix_hashes[digest] = self.prefix_hashes.get(digest, 0) + 1
 
-        user_msg = f"User Input: {user_input}\n\n{prompt}"
+        valid_cmds_str = "\n".join([f"- {cmd}" for cmd in sorted(valid_commands)])
+        user_msg = f"Commands usable here:\n{valid_cmds_str}\n\n"
+        user_msg += f"Current Location Context:\n{context}\n\n"
+        user_msg += f"Recent History:\n{history}\n\n"
+        user_msg += f"User Input: {user_input}"
 
-        messages = [
-            {"role": "system", "content": system_prompt},
+        return [
+            {"role": "system", "content": prefix},
             {"role": "user", "content": user_msg}
         ]
 
+    def _request(self, user_input, valid_commands, history, context, deadline=None):
+        model = self.config.get('model', 'gpt-5-nano')
+        temperature = self.config.get('temperature', 1)
+
+        messages = self.build_messages(user_input, valid_commands, history, context)
+
         payload = {
             "model": model,
             "messages": messages,
@@ -111,21 +843,353 @@ class AIClient:
             "temperature": temperature
         }
 
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        if self.stream:
+            return self._request_stream(payload, headers, deadline)
+
+        result = self.transport.post_json("/chat/completions", payload, headers=headers, deadline=deadline)
+        content = json.loads(result['choices'][0]['message']['content'])
+        return self._candidates(content)
+
+    def _request_stream(self, payload, headers, deadline):
+        payload = dict(payload, stream=True)
+        events = self.transport.stream_events("/chat/completions", payload, headers=headers, deadline=deadline)
+        text = ""
         try:
-            req = urllib.request.Request(
-                "https://api.openai.com/v1/chat/completions",
-                data=json.dumps(payload).encode('utf-8'),
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.api_key}"
-                }
-            )
-            with urllib.request.urlopen(req) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                content = json.loads(result['choices'][0]['message']['content'])
-                return content.get('command')
-        except Exception as e:
+            for event in events:
+                choices = event.get('choices') or [{}]
+                text += (choices[0].get('delta') or {}).get('content') or ""
+                # Stop reading as soon as the command field is complete in the partial JSON
+                found = self._early_fields(text)
+                if found:
+                    self.early_stops += 1
+                    return self._candidates(found)
+        finally:
+            events.close()
+        return self._candidates(json.loads(text))
+
+    @staticmethod
+    def _early_fields(text):
+        for field in ('"commands"', '"command"'):
+            at = text.find(field)
+            if at < 0: continue
+            colon = text.find(':', at + len(field))
+            if colon < 0: return None
+            try:
+                value, _ = json.JSONDecoder().raw_decode(text[colon + 1:].lstrip())
+            except ValueError:
+                return None
+            return {field.strip('"'): value}
+        return None
+
+    def _candidates(self, content):
+        raw = content.get('commands') or [content.get('command')]
+        if isinstance(raw, str): raw = [raw]
+        candidates = []
+        for cmd in raw:
+            if isinstance(cmd, str) and cmd.strip() and cmd.strip() not in candidates:
+                candidates.append(cmd.strip())
+        return candidates[:self.n_best]
+
+# ==========================================
+# LOCAL INTENT MAPPER
+# ==========================================
+class IntentMapper:
+    SYNONYMS = {
+        'take': ['get', 'grab', 'pick up', 'pick', 'collect', 'snatch', 'acquire'],
+        'drop': ['discard', 'put down', 'throw away', 'toss'],
+        'examine': ['inspect', 'x', 'check', 'study', 'observe', 'search', 'look over', 'view'],
+        'open': ['pry open', 'unseal'],
+        'close': ['shut', 'seal'],
+        'enter': ['climb into', 'climb in', 'get into', 'get in', 'go into', 'step into', 'hide in', 'climb on', 'get on', 'sit on'],
+        'push': ['press', 'move', 'nudge', 'slide'],
+        'pull': ['tug', 'yank', 'drag'],
+        'wear': ['put on', 'don'],
+        'eat': ['consume', 'devour', 'munch', 'swallow'],
+        'talk': ['speak to', 'speak with', 'chat with', 'talk with', 'greet', 'speak'],
+        'inventory': ['inv', 'items']
+    }
+    TYPO_MIN_LENGTH = 5
+
+    def __init__(self, world, story_synonyms=None):
+        self.world = world
+        table = {}
+        # Story synonyms are applied first so authors can override the built-in table
+        for source in (story_synonyms or {}, self.SYNONYMS):
+            for verb, phrases in source.items():
+                for phrase in phrases:
+                    table.setdefault(phrase.lower().strip(), verb)
+        self.phrases = sorted(table.items(), key=lambda kv: -len(kv[0].split()))
+
+    def clone(self, world):
+        # The phrase table depends only on the story, so cloned worlds share it
+        other = self.__class__.__new__(self.__class__)
+        other.__dict__.update(self.__dict__)
+        other.world = world
+        return other
+
+    def verbs(self):
+        return self.world.verb_catalog
+
+    def map(self, text):
+        tokens = text.split()
+        if not tokens: return None
+        if tokens[0] == 'use': return self._map_use(" ".join(tokens[1:]))
+
+        for phrase, verb in self.phrases:
+            if text == phrase or text.startswith(phrase + " "):
+                return f"{verb} {text[len(phrase):].strip()}".strip()
+
+        if tokens[0] in self.verbs() or tokens[0] in World.PARSER_WORDS: return None
+        # Only one typo, and only in longer verbs: short ones are a letter away from other real verbs
+        # (wake/take, lick/lock, hush/push)
+        if len(tokens[0]) < self.TYPO_MIN_LENGTH: return None
+        match = [v for v in self.verbs() if len(v) >= self.TYPO_MIN_LENGTH and self.typo_distance(tokens[0], v) <= 1]
+        if len(match) == 1: return " ".join(match + tokens[1:])
+        return None
+
+    @staticmethod
+    def typo_distance(a, b):
+        # Edit distance counting a swap of adjacent letters as one edit
+        if abs(len(a) - len(b)) > 1: return 2
+        prev2, prev = None, list(range(len(b) + 1))
+        for i in range(1, len(a) + 1):
+            row = [i] + [0] * len(b)
+            for j in range(1, len(b) + 1):
+                row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + (a[i - 1] != b[j - 1]))
+                if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                    row[j] = min(row[j], prev2[j - 2] + 1)
+            prev2, prev = prev, row
+        return prev[-1]
+
+    def _map_use(self, rest):
+        for prep in (' on ', ' with ', ' in '):
+            if prep in rest:
+                item_str, target_str = rest.split(prep, 1)
+                item = self.world.find_in_scope(item_str)
+                target = self.world.find_in_scope(target_str)
+                if not item or not target: return None
+                if target.has_prop('locked'): return f"unlock {target_str} with {item_str}"
+                if target.kind == 'container': return f"put {item_str} in {target_str}"
+                if target.kind == 'supporter': return f"put {item_str} on {target_str}"
+                return None
+
+        item = self.world.find_in_scope(rest)
+        if not item: return None
+        if item.has_prop('edible'): return f"eat {rest}"
+        if item.has_prop('wearable'): return f"wear {rest}"
+        if item.has_prop('openable') and not item.has_prop('open') and not item.has_prop('locked'): return f"open {rest}"
+        return None
+
+# ==========================================
+# LOCAL INTENT CLASSIFIER
+# ==========================================
+class IntentClassifier:
+    SLOT_STOPWORDS = {'in', 'on', 'with', 'to', 'about', 'at', 'into', 'from', 'under', 'inside',
+                      'north', 'south', 'east', 'west', 'up', 'down'}
+    ARTICLES = {'the', 'a', 'an'}
+
+    def __init__(self, path=None, threshold=0.8, min_examples=2):
+        self.path = path
+        self.threshold = threshold
+        self.min_examples = min_examples
+        self.hits = 0
+        self._model = None
+        self._loaded = False
+
+    def _load(self):
+        # The model file is only read the first time a turn reaches this tier
+        if not self._loaded:
+            self._loaded = True
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r') as f: self._model = json.load(f)
+                except Exception as e:
+                    print(f"Warning: Could not load intent model: {e}")
+        return self._model
+
+    @staticmethod
+    def features(tokens):
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    @classmethod
+    def templatize(cls, user_input, command):
+        # Spans shared by input and command become numbered slots, e.g. 'unlock {1} with {0}'
+        words = [w for w in user_input.lower().split() if w not in cls.ARTICLES]
+        cmd = [w for w in command.lower().split() if w not in cls.ARTICLES]
+        if not words or not cmd: return None
+
+        parts, spans = cmd[:1], {}
+        i = 1
+        while i < len(cmd):
+            match = None
+            for j in range(len(cmd), i, -1):
+                span = cmd[i:j]
+                # A slot never swallows a preposition, so two-object commands keep both slots
+                if any(w in cls.SLOT_STOPWORDS for w in span): continue
+                for at in range(len(words) - len(span) + 1):
+                    if words[at:at + len(span)] == span:
+                        match = (j, at, len(span))
+                        break
+                if match: break
+            if match:
+                spans[match[1]] = match[2]
+                parts.append(('slot', match[1]))
+                i = match[0]
+            else:
+                parts.append(cmd[i])
+                i += 1
+
+        positions = sorted(spans)
+        for a, b in zip(positions, positions[1:]):
+            if a + spans[a] > b: return None
+        slot_of = {pos: n for n, pos in enumerate(positions)}
+        template = " ".join("{%d}" % slot_of[p[1]] if isinstance(p, tuple) else p for p in parts)
+
+        tokens = []
+        i = 0
+        while i < len(words):
+            if i in spans:
+                tokens.append("<obj>")
+                i += spans[i]
+            else:
+                tokens.append(words[i])
+                i += 1
+        return tokens, template, len(positions)
+
+    @classmethod
+    def train(cls, pairs, story=None):
+        classes, vocab, examples = {}, set(), 0
+        for user_input, command in pairs:
+            result = cls.templatize(user_input, command)
+            if not result: continue
+            tokens, template, slots = result
+            entry = classes.setdefault(template, {'count': 0, 'slots': slots, 'total': 0, 'features': {}})
+            entry['count'] += 1
+            for f in cls.features(tokens):
+                entry['features'][f] = entry['features'].get(f, 0) + 1
+                entry['total'] += 1
+                vocab.add(f)
+            examples += 1
+        return {'version': 1, 'story': story or STORY_ID, 'examples': examples, 'vocab': len(vocab), 'classes': classes}
+
+    def _mentions(self, words, world):
+        phrases = set()
+        for e in world.get_scope():
+            if e.id == world.player_id: continue
+            phrases.add(e.name.lower())
+            phrases.update(a.lower() for a in e.aliases)
+            if e.kind == 'person': phrases.update(t.lower() for t in e.topics)
+        phrases = sorted((p.split() for p in phrases if p), key=len, reverse=True)
+
+        tokens, fills = [], []
+        i = 0
+        while i < len(words):
+            for p in phrases:
+                if words[i:i + len(p)] == p:
+                    tokens.append("<obj>")
+                    fills.append(" ".join(p))
+                    i += len(p)
+                    break
+            else:
+                tokens.append(words[i])
+                i += 1
+        return tokens, fills
+
+    def predict(self, text, world):
+        model = self._load()
+        if not model or not model.get('classes'): return None
+
+        words = [w for w in text.split() if w not in self.ARTICLES]
+        tokens, fills = self._mentions(words, world)
+        feats = self.features(tokens)
+        known = [f for f in feats if any(f in c['features'] for c in model['classes'].values())]
+        if len(known) * 2 < len(feats): return None
+
+        scores = {}
+        for template, c in model['classes'].items():
+            score = math.log(c['count'] / model['examples'])
+            denom = c['total'] + model['vocab']
+            for f in feats:
+                score += math.log((c['features'].get(f, 0) + 1) / denom)
+            scores[template] = score
+
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        confidence = 1.0 / sum(math.exp(v - top) for v in scores.values())
+        c = model['classes'][best]
+        # A template that would drop (or lack) a mentioned object is not this command
+        if confidence < self.threshold or c['count'] < self.min_examples or c['slots'] != len(fills):
             return None
+        return best.format(*fills)
+
+# ==========================================
+# AI CONTEXT
+# ==========================================
+class ContextBuilder:
+    def __init__(self, world, max_tokens=None):
+        self.world = world
+        self.max_tokens = max_tokens
+        self._key = None
+        self._fragments = None
+
+    def fragments(self):
+        # Entity and topic fragments are rebuilt only when the room or world state changes
+        room = self.world.get_player_room()
+        key = (room.id, self.world.version)
+        if key != self._key:
+            entities, topics = [], []
+            for e in self.world.get_scope():
+                if e.id == 'player': continue
+                name = e.name
+                if e.has_prop('locked'): name += " (locked)"
+                elif e.has_prop('closed'): name += " (closed)"
+                elif e.has_prop('open'): name += " (open)"
+                entities.append((e, name, self._words(" ".join([e.name] + e.aliases))))
+                if e.kind == 'person':
+                    for topic in e.topics:
+                        topics.append((e, topic, self._words(topic)))
+            self._key = key
+            self._fragments = (f"Location: {room.name}", entities, topics)
+        return self._fragments
+
+    @staticmethod
+    def _words(text):
+        return set(text.lower().replace("'", " ").split())
+
+    def _score(self, entity, words, input_words):
+        score = 10 * len(words & input_words)
+        if entity.id in self.world.mentions:
+            score += 1.0 / (1 + self.world.turn - self.world.mentions[entity.id])
+        return score
+
+    def build(self, user_input=None):
+        header, entities, topics = self.fragments()
+        input_words = self._words(user_input or "")
+
+        ranked = sorted(enumerate(entities), key=lambda ie: (-self._score(ie[1][0], ie[1][2], input_words), ie[0]))
+        max_tokens = self.max_tokens or self.world.ai_setting('context_tokens', 300)
+        budget = max_tokens * 4 - len(header)
+
+        visible = []
+        for _, (e, name, _) in ranked:
+            if len(name) + 2 > budget: break
+            visible.append(name)
+            budget -= len(name) + 2
+        lines = [header, f"Visible: {', '.join(visible)}"]
+
+        people = {}
+        ranked_topics = sorted(enumerate(topics), key=lambda it: (-self._score(it[1][0], it[1][2], input_words), it[0]))
+        for _, (e, topic, _) in ranked_topics:
+            if len(topic) + 2 > budget: break
+            people.setdefault(e.id, []).append(topic)
+            budget -= len(topic) + 2
+
+        for e, _, _ in entities:
+            if e.id in people:
+                lines.append(f"Person '{e.name}' Topics: {', '.join(people[e.id])}")
+
+        return "\n".join(lines)
 
 # ==========================================
 # CORE OBJECT MODEL
@@ -138,7 +1202,7 @@ class Entity:
         self.aliases = data.get('aliases', [])
         self.description = data.get('description', "")
         self.location_id = data.get('location', None)
-        self.properties = data.get('properties', {})
+        self.properties = dict(data.get('properties', {}))
         self.world = world
         self.contents = []
         self.kind = data.get('kind', 'thing')
@@ -156,10 +1220,20 @@ class Entity:
 
     def set_prop(self, prop, val):
         self.properties[prop] = val
+        self.world.version += 1
 
     def get_description(self):
         return self.description
 
+    def clone(self, world):
+        # Definition fields are shared with the template entity; only mutable state is copied
+        other = self.__class__.__new__(self.__class__)
+        other.__dict__.update(self.__dict__)
+        other.world = world
+        other.properties = self.properties.copy()
+        other.contents = self.contents[:]
+        return other
+
     def to_state(self):
         return {
             'location_id': self.location_id,
@@ -168,6 +1242,7 @@ class Entity:
         }
 
     def load_state(self, state):
+        self.world.version += 1
         self.location_id = state.get('location_id')
         self.properties = state.get('properties', {}).copy()
         self.contents = state.get('contents', [])[:]
@@ -235,7 +1310,7 @@ class Door(Thing):
     def __init__(self, id, data, world):
         super().__init__(id, data, world)
         self.kind = 'door'
-        self.connections = data.get('connections', {})
+        self.connections = dict(data.get('connections', {}))
         self.key_id = data.get('key', None)
         self.properties['portable'] = False
 
@@ -267,6 +1342,12 @@ class Rulebook:
     def __init__(self, world):
         self.world = world
 
+    @classmethod
+    def standard_verbs(cls):
+        if '_standard_verbs' not in cls.__dict__:
+            cls._standard_verbs = frozenset(m[6:] for m in dir(cls) if m.startswith("check_"))
+        return cls._standard_verbs
+
     def process(self, action):
         verb = action.verb
 
@@ -549,18 +1630,116 @@ class Action:
         self.topic = topic
 
 class World:
-    def __init__(self, data):
-        self.io = GameIO()
+    PARSER_WORDS = {'go', 'walk', 'insert', 'place', 'read', 'shift', 'shove', 'look', 'l', 'inventory', 'i',
+                    'wait', 'z', 'save', 'load', 'undo', 'menu', 'help', 'talk'}
+    COMMAND_FRAMES = [
+        "put [item] in [container]",
+        "put [item] on [supporter]",
+        "lock [item] with [key]",
+        "unlock [item] with [key]",
+        "ask [person] about [topic]",
+        "tell [person] about [topic]",
+        "go [direction]"
+    ]
+
+    def __init__(self, data, io=None, story_id=None):
+        # A world carries its own story identity so one loaded runtime can host many stories
+        self.data = data
+        self.story_id = story_id or STORY_ID
+        self.io = io or GameIO()
         self.entities = {}
+        self.version = 0
+        self.turn = 0
+        self.mentions = {}
         self.player_location = data['start_room']
         self.ai = AIClient(DM_CONFIG_FILE)
+        self.ai.story = self.story_id
         self.rulebook = Rulebook(self)
         self.history = []
+        self._pending_ai = None
+        self.intents = IntentMapper(self, data.get('synonyms', {}))
+        self.context = ContextBuilder(self)
+        self._classifier = None
+        self._history_configured = False
+        # Removed entities, kept so undo and restore can bring them back
+        self.removed = {}
+        # save/load use <story>.save unless save_file is None, which keeps the save in the world (and
+        # its snapshots) instead; the server does that so players of one story never share a file
+        self.save_file = f"{self.story_id}.save"
+        self.saved = None
 
         self.player_id = 'player'
         self.entities['player'] = Person('player', {'name': 'yourself', 'location': self.player_location}, self)
 
         self._load_data(data)
+        self._build_catalog()
+
+    def clone(self, io=None):
+        # New session from a prebuilt world: story definitions are shared, mutable state is copied
+        world = World.__new__(World)
+        world.__dict__.update(self.__dict__)
+        world.io = io or GameIO()
+        world.version = 0
+        world.turn = 0
+        world.mentions = {}
+        world.ai = AIClient(DM_CONFIG_FILE)
+        world.ai.story = self.story_id
+        world.ai.catalog = self.ai.catalog
+        world.rulebook = Rulebook(world)
+        world.history = []
+        world._pending_ai = None
+        world.intents = self.intents.clone(world)
+        world.context = ContextBuilder(world)
+        world._classifier = None
+        world._history_configured = False
+        world.removed = {eid: e.clone(world) for eid, e in self.removed.items()}
+        world.saved = None
+        world.entities = {eid: e.clone(world) for eid, e in self.entities.items()}
+        world.interaction_verbs = dict(self.interaction_verbs)
+        world._command_cache = {}
+        return world
+
+    def ai_setting(self, key, default):
+        # Reading AI settings loads the process-wide config, so this is only called on fallback paths
+        return getattr(self.ai, 'config', {}).get(key, default)
+
+    def ai_history(self):
+        # history_turns / history_bytes come from dm_config, so they are applied when the AI is first needed
+        if not self._history_configured:
+            self._history_configured = True
+            self.io.set_history_limits(self.ai_setting('history_turns', None), self.ai_setting('history_bytes', None))
+        return self.io.get_history_str()
+
+    @property
+    def classifier(self):
+        if self._classifier is None:
+            models = self.ai_setting('intent_models', os.path.join('stories', 'intents'))
+            self._classifier = IntentClassifier(
+                os.path.join(models, f"{self.story_id}.json"),
+                threshold=self.ai_setting('classifier_threshold', 0.8)
+            )
+        return self._classifier
+
+    def _build_catalog(self):
+        # Verb catalog is built once at load and only touched when entities are removed or brought back
+        self.interaction_verbs = {}
+        self._command_cache = {}
+        for e in self.entities.values():
+            self._index_interactions(e)
+        self._refresh_catalog()
+        # Story-wide command list forms the static AI prompt prefix; it is fixed here so the prefix stays
+        # byte-identical for the whole story, and only the per-turn scoped list follows the world
+        self.ai.catalog = sorted(f"{v} [noun]" for v in self.verb_catalog) + sorted(self.COMMAND_FRAMES)
+
+    def _index_interactions(self, entity):
+        verbs = {rule['verb'] for rule in entity.interactions if 'verb' in rule}
+        if verbs: self.interaction_verbs[entity.id] = verbs
+        else: self.interaction_verbs.pop(entity.id, None)
+
+    def _refresh_catalog(self):
+        verbs = set(Rulebook.standard_verbs())
+        for v in self.interaction_verbs.values(): verbs |= v
+        self.verb_catalog = frozenset(verbs)
 
     def save_state_to_memory(self):
         return {
@@ -569,10 +1748,38 @@ class World:
         }
 
     def load_state_from_memory(self, state):
+        # The entity set follows the state: removed entities (e.g. eaten) that it lists come back,
+        # and ones it lacks are removed, so undo and a thawed snapshot agree with the live world
+        for eid in [e for e in self.entities if e not in state['entities']]:
+            self.remove_entity(eid)
+        for eid in [e for e in state['entities'] if e not in self.entities and e in self.removed]:
+            self.entities[eid] = self.removed.pop(eid)
+            self._index_interactions(self.entities[eid])
+            self._refresh_catalog()
         self.move_entity('player', state['player_loc'])
         for eid, s in state['entities'].items():
             if eid in self.entities: self.entities[eid].load_state(s)
 
+    def snapshot(self):
+        # Everything a session needs to resume in another World: state, undo journal and IO history
+        return {
+            'story': self.story_id,
+            'turn': self.turn,
+            'mentions': self.mentions.copy(),
+            'state': self.save_state_to_memory(),
+            'undo': self.history[:],
+            'saved': self.saved,
+            'io': self.io.to_state()
+        }
+
+    def restore(self, snapshot):
+        self.load_state_from_memory(snapshot['state'])
+        self.history = snapshot.get('undo', [])[:]
+        self.turn = snapshot.get('turn', 0)
+        self.mentions = dict(snapshot.get('mentions', {}))
+        self.saved = snapshot.get('saved')
+        self.io.load_state(snapshot.get('io', {}))
+
     def _load_data(self, data):
         for scene in data.get('scenes', []):
             r = Room(scene['id'], scene, self)
@@ -613,11 +1820,13 @@ class World:
         elif kind == 'supporter': cls = Supporter
         elif kind == 'person': cls = Person
         elif kind == 'door': cls = Door
-        elif kind == 'wearable': cls = Thing; data['properties'] = data.get('properties', {}); data['properties']['wearable'] = True
-        elif kind == 'edible': cls = Thing; data['properties'] = data.get('properties', {}); data['properties']['edible'] = True
         else: cls = Thing
 
-        data['location'] = loc_id
+        # Story data is never written to, so one dict can back any number of worlds
+        data = dict(data, location=loc_id)
+        if kind in ('wearable', 'edible'):
+            data['properties'] = dict(data.get('properties', {}))
+            data['properties'][kind] = True
         obj = cls(data['id'], data, self)
         self.entities[obj.id] = obj
 
@@ -644,6 +1853,7 @@ class World:
              try: self.entities[obj.location_id].contents.remove(obj_id)
              except: pass
         obj.location_id = dest_id
+        self.version += 1
         if dest_id in self.entities:
             self.entities[dest_id].contents.append(obj_id)
 
@@ -653,7 +1863,9 @@ class World:
         if obj.location_id and obj.location_id in self.entities:
              try: self.entities[obj.location_id].contents.remove(obj_id)
              except: pass
-        del self.entities[obj_id]
+        self.removed[obj_id] = self.entities.pop(obj_id)
+        self.version += 1
+        if self.interaction_verbs.pop(obj_id, None): self._refresh_catalog()
 
     def apply_effect(self, effect):
         t = effect.get('type')
@@ -701,6 +1913,11 @@ class World:
         return True
 
     def find_in_scope(self, name):
+        ent = self._lookup(name)
+        if ent: self.mentions[ent.id] = self.turn
+        return ent
+
+    def _lookup(self, name):
         if not name: return None
         scope = self.get_scope()
         for ent in scope:
@@ -709,29 +1926,8 @@ class World:
             if name in ent.name.lower(): return ent
         return None
 
-    def get_current_context(self):
-        room = self.get_player_room()
-        scope = self.get_scope()
-
-        context_lines = []
-        context_lines.append(f"Location: {room.name}")
-
-        visible_names = []
-        for e in scope:
-            if e.id == 'player': continue
-            name = e.name
-            if e.has_prop('locked'): name += " (locked)"
-            elif e.has_prop('closed'): name += " (closed)"
-            elif e.has_prop('open'): name += " (open)"
-            visible_names.append(name)
-        context_lines.append(f"Visible: {', '.join(visible_names)}")
-
-        for e in scope:
-            if e.kind == 'person' and e.topics:
-                topics = ", ".join(e.topics.keys())
-                context_lines.append(f"Person '{e.name}' Topics: {topics}")
-
-        return "\n".join(context_lines)
+    def get_current_context(self, user_input=None):
+        return self.context.build(user_input)
 
     def look(self):
         room = self.get_player_room()
@@ -804,16 +2000,11 @@ class World:
             self.io.write("You can't go that way.")
 
     def parse(self, text):
-        text = text.lower().strip()
+        text = self._normalize(text)
         if not text: return
 
-        for w in ['the ', 'a ', 'an ']:
-            text = text.replace(f" {w}", " ")
-            if text.startswith(w): text = text[len(w):]
-
-        text = text.replace('talk to ', 'talk ')
-
         self.io.log_input(text)
+        self.turn += 1
 
         meta_commands = ['save', 'load', 'undo', 'look', 'l', 'inventory', 'i', 'help']
         is_meta = text in meta_commands or text.split()[0] in meta_commands
@@ -822,6 +2013,43 @@ class World:
             self.history.append(self.save_state_to_memory())
             if len(self.history) > 10: self.history.pop(0)
 
+        try:
+            return self._dispatch(text)
+        finally:
+            # A speculative AI request is dropped once the local parser has handled the turn
+            if self._pending_ai:
+                self._pending_ai[0].cancel()
+                self._pending_ai = None
+
+    def _normalize(self, text):
+        text = text.lower().strip()
+        for w in ['the ', 'a ', 'an ']:
+            text = text.replace(f" {w}", " ")
+            if text.startswith(w): text = text[len(w):]
+        return text.replace('talk to ', 'talk ')
+
+    def _unknown_verb(self, verb):
+        return verb not in self.PARSER_WORDS and verb not in self.verb_catalog
+
+    def _speculate(self, text):
+        local = self.intents.map(text)
+        if (local and self.resolves(local)) or self.classifier.predict(text, self): return
+        args = (text, self.get_valid_commands(), self.ai_history(), self.get_current_context(text))
+        deadline = self.ai.deadline()
+        future = self.ai.prefetch(*args, deadline=deadline)
+        if future: self._pending_ai = (future, args, deadline)
+
+    def get_valid_commands(self):
+        # Scoped to the standard verbs plus interaction verbs of things within reach
+        verbs = set(Rulebook.standard_verbs())
+        for e in self.get_scope() + [self.get_player()]:
+            verbs |= self.interaction_verbs.get(e.id, set())
+        key = frozenset(verbs)
+        if key not in self._command_cache:
+            self._command_cache[key] = sorted(f"{v} [noun]" for v in verbs) + sorted(self.COMMAND_FRAMES)
+        return list(self._command_cache[key])
+
+    def _dispatch(self, text, fallback=True):
         dirs = {'n':'north','s':'south','e':'east','w':'west','u':'up','d':'down'}
         if text in dirs: text = dirs[text]
         if text in ['north','south','east','west','up','down']:
@@ -844,6 +2072,8 @@ class World:
         if verb == 'read': verb = 'examine'
         if verb == 'shift' or verb == 'shove': verb = 'push'
 
+        if fallback and self._unknown_verb(verb) and self.ai.speculative: self._speculate(text)
+
         if verb == 'look' and len(tokens) > 1:
             if ' around' in text:
                 verb = 'look'
@@ -915,43 +2145,96 @@ class World:
                 if self.rulebook.process(Action(verb, noun=noun)):
                     return
 
-        # AI Fallback - Dynamic
-        std_verbs = set()
-        for m in dir(self.rulebook):
-            if m.startswith("check_"):
-                std_verbs.add(m[6:])
+        if not fallback: return False
 
-        for e in self.entities.values():
-            for rule in e.interactions:
-                if 'verb' in rule: std_verbs.add(rule['verb'])
-
-        valid_cmds = []
-        for v in std_verbs:
-             valid_cmds.append(f"{v} [noun]")
-
-        valid_cmds.append("put [item] in [container]")
-        valid_cmds.append("put [item] on [supporter]")
-        valid_cmds.append("lock [item] with [key]")
-        valid_cmds.append("unlock [item] with [key]")
-        valid_cmds.append("ask [person] about [topic]")
-        valid_cmds.append("tell [person] about [topic]")
-        valid_cmds.append("go [direction]")
-
-        context = self.get_current_context()
-        history = self.io.get_history_str()
-
-        mapped = self.ai.map_command(text, valid_cmds, history, context)
-        if mapped:
-            if mapped.lower().strip() == text:
-                self.io.write("I understand, but I can't do that right now.")
-            else:
+        # Local intent tier: phrasal verbs, story synonyms and near-miss verbs
+        local = self.intents.map(text)
+        if local and local != text and self.resolves(local):
+            res = self._dispatch(local, fallback=False)
+            if res is not False: return res
+
+        # Classifier tier trained from logged AI mappings (src/train_intents.py)
+        predicted = self.classifier.predict(text, self)
+        if predicted and predicted != text and self.resolves(predicted):
+            res = self._dispatch(predicted, fallback=False)
+            if res is not False:
+                self.classifier.hits += 1
+                return res
+
+        # AI Fallback - Dynamic
+        if self._pending_ai and self._pending_ai[1][0] == text:
+            future, _, deadline = self._pending_ai
+            self._pending_ai = None
+            try:
+                candidates = future.result(timeout=max(0, deadline - time.monotonic()) + 0.5)
+            except Exception:
+                candidates = []
+        else:
+            valid_cmds = self.get_valid_commands()
+            context = self.get_current_context(text)
+            history = self.ai_history()
+            candidates = self.ai.map_candidates(text, valid_cmds, history, context)
+
+        # Candidates are dry-run against the parser and scope; the first that resolves is executed
+        for mapped in candidates:
+            cmd = self._normalize(mapped)
+            if cmd == text: continue
+            if self.resolves(cmd):
                 self.io.write(f"[AI Interpreted: {mapped}]")
-                self.parse(mapped)
+                if self._dispatch(cmd, fallback=False) is False:
+                    self.io.write("I didn't understand that.")
+                return
+
+        if candidates and self._normalize(candidates[0]) == text:
+            self.io.write("I understand, but I can't do that right now.")
         else:
             self.io.write("I didn't understand that.")
 
+    def resolves(self, text):
+        tokens = text.split()
+        if not tokens: return False
+        dirs = {'n':'north','s':'south','e':'east','w':'west','u':'up','d':'down'}
+        if tokens[0] in ('go', 'walk') and len(tokens) > 1: tokens = tokens[1:]
+        if len(tokens) == 1 and dirs.get(tokens[0], tokens[0]) in ['north','south','east','west','up','down']: return True
+
+        verb = {'insert': 'put', 'place': 'put', 'read': 'examine', 'shift': 'push', 'shove': 'push'}.get(tokens[0], tokens[0])
+        if verb == 'look' and len(tokens) > 1: verb = 'examine'
+        if verb in ('look', 'l', 'inventory', 'i', 'wait', 'z') and len(tokens) == 1: return True
+        if verb not in self.verb_catalog: return False
+
+        rest = " ".join(tokens[1:])
+        for w in ('at ', 'inside ', 'in ', 'under '):
+            if tokens[0] == 'look' and rest.startswith(w): rest = rest[len(w):]
+
+        if verb in ('ask', 'tell') and ' about ' in rest:
+            return self._lookup(rest.split(' about ', 1)[0]) is not None
+
+        targets = []
+        for p in (' in ', ' on ', ' with ', ' to '):
+            if p in f" {rest} ":
+                noun_str, second_str = f" {rest} ".split(p, 1)
+                targets = [self._lookup(noun_str.strip()), self._lookup(second_str.strip())]
+                break
+        else:
+            if rest: targets = [self._lookup(rest)]
+        if None in targets: return False
+        if verb in Rulebook.standard_verbs(): return True
+        # Story verbs only resolve against things (or the room) that declare them
+        targets.append(self.get_player_room())
+        return any(verb in self.interaction_verbs.get(t.id, ()) for t in targets)
+
+    def intro(self):
+        title = self.data.get('title', 'Untitled')
+        author = self.data.get('author', 'Anonymous')
+
+        self.io.write(f"\n\"{title}\"")
+        self.io.write(f"An Interactive Fiction by {author}")
+        self.io.write("Release 1 / Lore Lock Engine\n")
+
+        self.look()
+
     def check_win(self):
-        win = GAME_DATA.get('win_condition')
+        win = self.data.get('win_condition')
         if win and win.get('type') == 'location':
             if self.get_player_room().id == win['target']:
                 self.io.write("\n*** YOU HAVE WON ***")
@@ -960,44 +2243,50 @@ class World:
         return False
 
     def save_game(self):
-        filename = f"{STORY_ID}.save"
-        state = {
-            'player_loc': self.entities['player'].location_id,
-            'entities': {eid: e.to_state() for eid, e in self.entities.items()}
-        }
-        with open(filename, 'w') as f: json.dump(state, f)
-        self.io.write(f"Saved to {filename}.")
+        if self.save_file is None:
+            self.saved = self.save_state_to_memory()
+            self.io.write("Saved.")
+            return
+        with open(self.save_file, 'w') as f: json.dump(self.save_state_to_memory(), f)
+        self.io.write(f"Saved to {self.save_file}.")
 
     def load_game(self):
-        filename = f"{STORY_ID}.save"
-        try:
-            with open(filename, 'r') as f: state = json.load(f)
-            self.move_entity('player', state['player_loc'])
-            for eid, s in state['entities'].items():
-                if eid in self.entities: self.entities[eid].load_state(s)
-            self.io.write(f"Loaded from {filename}.")
-            self.look()
-        except: self.io.write("No save file found.")
+        state = self.saved
+        if self.save_file is not None:
+            try:
+                with open(self.save_file, 'r') as f: state = json.load(f)
+            except (OSError, ValueError):
+                state = None
+        if state is None:
+            self.io.write("No save file found." if self.save_file else "Nothing has been saved yet.")
+            return
+        # Same path as undo and restore, so entities eaten since the save come back
+        self.load_state_from_memory(state)
+        self.io.write(f"Loaded from {self.save_file}." if self.save_file else "Loaded.")
+        self.look()
 
 def main():
     game = World(GAME_DATA)
+    game.intro()
+    game.io.flush()
 
-    title = GAME_DATA.get('title', 'Untitled')
-    author = GAME_DATA.get('author', 'Anonymous')
+    report = "--startup-report" in sys.argv or os.environ.get("LORE_LOCK_STARTUP_REPORT")
+    if report:
+        print(startup_report(time.perf_counter() - _STARTED), file=sys.stderr)
+        at_prompt = len(IMPORT_TIMES)
 
-    game.io.write(f"\n\"{title}\"")
-    game.io.write(f"An Interactive Fiction by {author}")
-    game.io.write("Release 1 / Lore Lock Engine\n")
-
-    game.look()
     while True:
         try:
             cmd = input("> ")
             if cmd == "quit": break
             res = game.parse(cmd)
-            if res == "menu": break
-            if game.check_win(): break
+            won = res != "menu" and game.check_win()
+            game.io.flush()
+            if res == "menu" or won: break
         except EOFError: break
 
+    if report and len(IMPORT_TIMES) > at_prompt:
+        print("deferred imports:\n" + startup_report(since=at_prompt), file=sys.stderr)
+
 if __name__ == "__main__":
     main()
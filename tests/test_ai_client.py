@@ -0,0 +1,287 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from compiler import generate_runtime_code
+
+RUNTIME = {}
+exec(generate_runtime_code(), RUNTIME)
+AIError = RUNTIME['AIError']
+
+class Endpoint:
+    # A local stand-in for the chat completions endpoint; each request takes the next (status, body)
+    def __init__(self, replies, delay=0):
+        self.replies = list(replies)
+        self.delay = delay
+        self.calls = 0
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                endpoint.calls += 1
+                time.sleep(endpoint.delay)
+                status, body = endpoint.replies.pop(0) if len(endpoint.replies) > 1 else endpoint.replies[0]
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class StreamEndpoint:
+    # Streams the completion as server-sent events in small pieces, then holds the stream open
+    # until released so a client that reads to the end is noticed
+    def __init__(self, content, piece=4):
+        self.hold = threading.Event()
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                try:
+                    for at in range(0, len(content), piece):
+                        self.event({'choices': [{'delta': {'content': content[at:at + piece]}}]})
+                    endpoint.hold.wait(5)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except OSError:
+                    pass
+
+            def event(self, body):
+                self.wfile.write(b"data: " + json.dumps(body).encode('utf-8') + b"\n\n")
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.hold.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline: return False
+        time.sleep(0.001)
+    return True
+
+def completion(commands):
+    return {'choices': [{'message': {'content': json.dumps({'commands': commands})}}]}
+
+class TestResponseCache(unittest.TestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = RUNTIME['ResponseCache'](size=2)
+        cache.put('a', ['look'])
+        cache.put('b', ['wait'])
+        cache.get('a')
+        cache.put('c', ['north'])
+        self.assertEqual(cache.get('a'), (True, ['look']))
+        self.assertEqual(cache.get('b'), (False, None))
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1, 'size': 2})
+
+    def test_key_ignores_case_and_spacing(self):
+        key = RUNTIME['ResponseCache'].key
+        self.assertEqual(key('doors', 'Open  the DOOR', ['open [noun]'], 'ctx'), key('doors', 'open the door', ['open [noun]'], 'ctx'))
+        self.assertNotEqual(key('doors', 'open the door', ['open [noun]'], 'ctx'), key('doors', 'open the door', ['open [noun]'], 'other'))
+
+    def test_entries_persist_in_the_store(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, 'cache.db')
+        RUNTIME['ResponseCache'](path=path).put('k', ['take key'])
+        self.assertEqual(RUNTIME['ResponseCache'](path=path).get('k'), (True, ['take key']))
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_threshold(self):
+        breaker = RUNTIME['CircuitBreaker'](threshold=2, cooldown=60)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.stats()['trips'], 1)
+
+    def test_half_open_lets_one_probe_through(self):
+        breaker = RUNTIME['CircuitBreaker'](threshold=1, cooldown=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        # A probe that never reached the endpoint hands its turn to the next caller
+        breaker.release()
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.stats()['state'], 'closed')
+        self.assertTrue(breaker.allow())
+
+class TestAIScheduler(unittest.TestCase):
+    def test_identical_requests_share_one_upstream_call(self):
+        scheduler = RUNTIME['AIScheduler'](max_concurrency=4)
+        started = threading.Event()
+        finish = threading.Event()
+        results = []
+
+        def call():
+            started.set()
+            finish.wait(5)
+            return ['take key']
+
+        def submit(session):
+            results.append(scheduler.submit(session, 'same', call))
+
+        owner = threading.Thread(target=submit, args=('a',))
+        owner.start()
+        started.wait(5)
+        waiters = [threading.Thread(target=submit, args=(s,)) for s in ('b', 'c')]
+        for t in waiters: t.start()
+        time.sleep(0.1)
+        finish.set()
+        for t in [owner] + waiters: t.join(5)
+        self.assertEqual(results, [['take key']] * 3)
+        self.assertEqual(scheduler.stats()['upstream'], 1)
+        self.assertEqual(scheduler.stats()['coalesced'], 2)
+
+    def test_slots_freed_together_are_both_taken(self):
+        # A waiter that found it was not next must be woken again once the one ahead of it starts
+        for _ in range(50):
+            scheduler = RUNTIME['AIScheduler'](max_concurrency=2)
+            release = threading.Event()
+            finish = threading.Event()
+            started = []
+
+            def wait(session):
+                started.append(session)
+                return finish.wait(5)
+
+            threads = [threading.Thread(target=scheduler.submit, args=(s, s, release.wait)) for s in ('a', 'b')]
+            for t in threads: t.start()
+            self.assertTrue(wait_for(lambda: scheduler.stats()['active'] == 2))
+            waiters = [threading.Thread(target=scheduler.submit, args=(s, s, lambda s=s: wait(s))) for s in ('c', 'd')]
+            for t in waiters: t.start()
+            self.assertTrue(wait_for(lambda: scheduler.stats()['queued'] == 2))
+            release.set()
+            try:
+                self.assertTrue(wait_for(lambda: len(started) == 2, timeout=1), "a free slot was left unused")
+            finally:
+                finish.set()
+                for t in threads + waiters: t.join(5)
+
+    def test_deadline_expires_while_queued(self):
+        scheduler = RUNTIME['AIScheduler'](max_concurrency=1)
+        finish = threading.Event()
+        busy = threading.Thread(target=scheduler.submit, args=('a', 'slow', lambda: finish.wait(5)))
+        busy.start()
+        time.sleep(0.05)
+        try:
+            with self.assertRaises(AIError):
+                scheduler.submit('b', 'other', lambda: ['look'], deadline=time.monotonic() + 0.1)
+        finally:
+            finish.set()
+            busy.join(5)
+
+class TestHTTPTransport(unittest.TestCase):
+    def test_retries_server_errors(self):
+        endpoint = Endpoint([(503, {}), (200, completion(['look']))])
+        self.addCleanup(endpoint.close)
+        transport = RUNTIME['HTTPTransport'](endpoint.url, retries=2, backoff=0)
+        self.addCleanup(transport.close)
+        result = transport.post_json('/chat/completions', {}, headers={})
+        self.assertEqual(result, completion(['look']))
+        self.assertEqual(endpoint.calls, 2)
+
+    def test_client_errors_are_not_retried(self):
+        endpoint = Endpoint([(400, {'error': 'bad request'})])
+        self.addCleanup(endpoint.close)
+        transport = RUNTIME['HTTPTransport'](endpoint.url, retries=2, backoff=0)
+        self.addCleanup(transport.close)
+        with self.assertRaises(AIError):
+            transport.post_json('/chat/completions', {}, headers={})
+        self.assertEqual(endpoint.calls, 1)
+
+class TestAIClient(unittest.TestCase):
+    def setUp(self):
+        self.environ = dict(os.environ)
+        os.environ['OPENAI_API_KEY'] = 'test'
+        self.addCleanup(self.restore_environ)
+
+    def restore_environ(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def client(self, endpoint, session):
+        os.environ['OPENAI_BASE_URL'] = endpoint.url
+        client = RUNTIME['AIClient'](os.path.join(ROOT, 'dm_config.yaml'))
+        client.session = session
+        client.story = 'test'
+        return client
+
+    def test_candidates_come_from_the_endpoint(self):
+        endpoint = Endpoint([(200, completion(['take brass key', 'take key']))])
+        self.addCleanup(endpoint.close)
+        client = self.client(endpoint, 's')
+        self.assertEqual(client.map_candidates('pocket the key', ['take [noun]'], '', 'ctx'), ['take brass key', 'take key'])
+        # A repeat is answered from the cache
+        self.assertEqual(client.map_candidates('pocket the key', ['take [noun]'], '', 'ctx'), ['take brass key', 'take key'])
+        self.assertEqual(endpoint.calls, 1)
+
+    def test_coalesced_failure_counts_once(self):
+        endpoint = Endpoint([(400, {'error': 'bad request'})], delay=0.3)
+        self.addCleanup(endpoint.close)
+        clients = [self.client(endpoint, f"s{i}") for i in range(3)]
+        threads = [threading.Thread(target=c.map_candidates, args=('frobnicate the widget', ['look'], '', 'ctx')) for c in clients]
+        for t in threads: t.start()
+        for t in threads: t.join(10)
+        self.assertEqual(endpoint.calls, 1)
+        self.assertEqual([c.failures for c in clients], [1, 1, 1])
+        self.assertEqual(clients[0].breaker.stats()['failures'], 1)
+        self.assertEqual(clients[0].breaker.stats()['state'], 'closed')
+
+    def test_stream_stops_once_commands_are_complete(self):
+        content = json.dumps({'commands': ['push slab', 'examine slab'], 'reasoning': 'the slab looks loose'})
+        endpoint = StreamEndpoint(content)
+        self.addCleanup(endpoint.close)
+        client = self.client(endpoint, 's')
+        started = time.monotonic()
+        with mock.patch.dict(client._settings().values, {'stream': True}):
+            candidates = client.map_candidates('heave the stone slab', ['push [noun]'], '', 'ctx')
+        self.assertEqual(candidates, ['push slab', 'examine slab'])
+        # Returned while the endpoint was still holding the rest of the stream
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertFalse(endpoint.hold.is_set())
+        self.assertEqual(client.early_stops, 1)
+
+    def test_partial_fields_wait_for_more(self):
+        early = RUNTIME['AIClient']._early_fields
+        self.assertIsNone(early('{"commands": ["push sl'))
+        self.assertIsNone(early('{"reasoning": "use the'))
+        self.assertEqual(early('{"command": "push slab", "reas'), {'command': 'push slab'})
+
+if __name__ == '__main__':
+    unittest.main()
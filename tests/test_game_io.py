@@ -0,0 +1,77 @@
+import io
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from compiler import generate_runtime_code
+
+RUNTIME = {}
+exec(generate_runtime_code(), RUNTIME)
+GameIO = RUNTIME['GameIO']
+
+class CountingSink:
+    def __init__(self):
+        self.writes = []
+
+    def emit(self, text):
+        self.writes.append(text)
+
+class TestGameIO(unittest.TestCase):
+    def test_a_turn_is_emitted_once(self):
+        sink = CountingSink()
+        game_io = GameIO(sink)
+        game_io.write("**Cell**")
+        game_io.write("It is damp.")
+        self.assertEqual(sink.writes, [])
+        game_io.flush()
+        game_io.flush()
+        self.assertEqual(sink.writes, ["**Cell**\nIt is damp.\n"])
+
+    def test_history_keeps_the_turn_output(self):
+        game_io = GameIO(CountingSink())
+        game_io.log_input("look")
+        game_io.write("**Cell**")
+        game_io.flush()
+        game_io.log_input("wait")
+        self.assertEqual(game_io.get_history_str(), "User: look\nSystem: **Cell**")
+
+class TestSinks(unittest.TestCase):
+    def test_memory_sink_drains(self):
+        sink = RUNTIME['MemorySink']()
+        sink.emit("one\n")
+        sink.emit("two\n")
+        self.assertEqual(sink.drain(), "one\ntwo\n")
+        self.assertEqual(sink.drain(), "")
+
+    def test_stdout_sink_writes_to_its_stream(self):
+        stream = io.StringIO()
+        RUNTIME['StdoutSink'](stream).emit("Taken.\n")
+        self.assertEqual(stream.getvalue(), "Taken.\n")
+
+    def test_file_sink_appends(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, 'transcript.txt')
+        sink = RUNTIME['FileSink'](path)
+        # Nothing is opened until there is something to write
+        self.assertFalse(os.path.exists(path))
+        sink.emit("one\n")
+        sink.emit("two\n")
+        sink.close()
+        with open(path, 'r') as f: self.assertEqual(f.read(), "one\ntwo\n")
+
+    def test_socket_sink_sends_encoded_text(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        RUNTIME['SocketSink'](a).emit("Café\n")
+        self.assertEqual(b.recv(100), "Café\n".encode('utf-8'))
+
+if __name__ == '__main__':
+    unittest.main()
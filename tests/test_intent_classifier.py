@@ -0,0 +1,62 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+import yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from compiler import generate_runtime_code
+
+RUNTIME = {}
+exec(generate_runtime_code(), RUNTIME)
+IntentClassifier = RUNTIME['IntentClassifier']
+
+PAIRS = [
+    ("jimmy iron bars with rusty shiv", "unlock iron bars with rusty shiv"),
+    ("jimmy the bars with the shiv", "unlock bars with shiv"),
+    ("shove the stone slab", "push stone slab"),
+    ("shove slab", "push slab"),
+]
+
+class TestIntentClassifier(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(ROOT, 'stories', 'yaml', 'prison_break.yaml'), 'r') as f:
+            data = yaml.safe_load(f)
+        self.sink = RUNTIME['MemorySink']()
+        self.world = RUNTIME['World'](data, io=RUNTIME['GameIO'](self.sink), story_id='prison_break')
+        self.world.move_entity('rusty shiv', 'player')
+
+        fd, self.model_path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f: json.dump(IntentClassifier.train(PAIRS, story='prison_break'), f)
+        self.world._classifier = IntentClassifier(self.model_path)
+
+    def tearDown(self):
+        os.remove(self.model_path)
+
+    def test_two_object_template(self):
+        tokens, template, slots = IntentClassifier.templatize(*PAIRS[0])
+        self.assertEqual(template, "unlock {0} with {1}")
+        self.assertEqual(tokens, ["jimmy", "<obj>", "with", "<obj>"])
+        self.assertEqual(slots, 2)
+
+    def test_predicts_two_object_command(self):
+        predicted = self.world.classifier.predict("jimmy iron bars with rusty shiv", self.world)
+        self.assertEqual(predicted, "unlock iron bars with rusty shiv")
+        self.assertTrue(self.world.resolves(predicted))
+
+        self.world.parse("jimmy iron bars with rusty shiv")
+        self.world.io.flush()
+        self.assertFalse(self.world.entities['iron bars'].has_prop('locked'))
+        self.assertEqual(self.world.classifier.hits, 1)
+
+    def test_single_object_command(self):
+        self.assertEqual(self.world.classifier.predict("shove slab", self.world), "push slab")
+        # Two mentioned objects never fit a one-slot template
+        self.assertIsNone(self.world.classifier.predict("shove slab with shiv", self.world))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import server
+
+server.STORY_DIR = os.path.join(ROOT, 'stories', 'yaml')
+
+class TestStoryRegistry(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        probe = server.StoryRegistry()
+        cls.sizes = {story: server.StoryEntry(probe.template(story)).size for story in ('doors', 'wear_eat', 'containers')}
+
+    def test_template_is_loaded_once_and_shared(self):
+        registry = server.StoryRegistry()
+        self.assertIs(registry.template('doors'), registry.template('doors'))
+        self.assertEqual(registry.loads, 1)
+
+    def test_least_recently_used_story_is_evicted(self):
+        registry = server.StoryRegistry(budget=self.sizes['doors'] + self.sizes['containers'])
+        registry.template('doors')
+        registry.template('wear_eat')
+        registry.template('doors')
+        registry.template('containers')
+        self.assertEqual(list(registry.entries), ['doors', 'containers'])
+        self.assertEqual(registry.evictions, 1)
+
+    def test_stories_with_sessions_stay(self):
+        registry = server.StoryRegistry(budget=1)
+        registry.template('doors', acquire=True)
+        registry.template('wear_eat')
+        self.assertEqual(list(registry.entries), ['doors', 'wear_eat'])
+        registry.release('doors')
+        # The most recently used story is kept even when it alone is over budget
+        self.assertEqual(list(registry.entries), ['wear_eat'])
+
+    def test_preload_builds_each_story_once(self):
+        registry = server.StoryRegistry()
+        with server.ThreadPoolExecutor(max_workers=3) as executor:
+            worlds = registry.preload(['doors', 'wear_eat', 'doors'], executor)
+        self.assertIs(worlds[0], worlds[2])
+        self.assertEqual(registry.loads, 2)
+
+class TestGameServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.server = server.GameServer(['doors'], max_command=64, store=os.path.join(self.folder, 'sessions.db'))
+        self.listener = await asyncio.start_server(self.server.handle, '127.0.0.1', 0, limit=self.server.stream_limit())
+        self.port = self.listener.sockets[0].getsockname()[1]
+        self.writers = []
+
+    async def asyncTearDown(self):
+        # Clients leave first so their handlers finish before the loop goes away
+        for writer in self.writers: await self.disconnect(writer)
+        while self.server.connections: await asyncio.sleep(0.01)
+        self.listener.close()
+        await self.listener.wait_closed()
+        self.server.close()
+        shutil.rmtree(self.folder)
+
+    async def connect(self, hello):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        self.writers.append(writer)
+        await reader.readuntil(b"begin.\n> ")
+        writer.write(hello.encode('utf-8') + b"\n")
+        return reader, writer, await self.prompt(reader)
+
+    async def disconnect(self, writer):
+        writer.close()
+        try: await writer.wait_closed()
+        except (ConnectionError, OSError): pass
+
+    async def prompt(self, reader):
+        return (await asyncio.wait_for(reader.readuntil(b"> "), 5)).decode('utf-8')
+
+    async def command(self, reader, writer, line):
+        writer.write(line.encode('utf-8') + b"\n")
+        return await self.prompt(reader)
+
+    async def test_plays_a_session(self):
+        reader, writer, intro = await self.connect("play doors a")
+        self.assertIn("[session a]", intro)
+        self.assertIn("Taken.", await self.command(reader, writer, "take brass key"))
+        self.assertIn("brass key", await self.command(reader, writer, "inventory"))
+
+    async def test_overlong_line_is_refused(self):
+        reader, writer, _ = await self.connect("play doors a")
+        # Far beyond the stream limit as well as max_command
+        reply = await self.command(reader, writer, "x" * 20000)
+        self.assertIn("too long (limit 64 bytes)", reply)
+        self.assertIn("Hallway", await self.command(reader, writer, "look"))
+
+    async def test_session_is_connected_once(self):
+        await self.connect("play doors a")
+        _, _, reply = await self.connect("play doors a")
+        self.assertIn("Session a is already connected.", reply)
+
+    async def test_resumes_after_hibernation(self):
+        reader, writer, _ = await self.connect("play doors a")
+        await self.command(reader, writer, "take brass key")
+        await self.disconnect(writer)
+        await asyncio.sleep(0.1)
+        await self.server.hibernate(self.server.sessions['a'])
+        self.assertNotIn('a', self.server.sessions)
+
+        reader, writer, intro = await self.connect("play doors a")
+        self.assertEqual(self.server.restored, 1)
+        self.assertIn("brass key", await self.command(reader, writer, "inventory"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import server
+
+server.STORY_DIR = os.path.join(ROOT, 'stories', 'yaml')
+
+COMMANDS = ['take apple', 'eat apple', 'inventory', 'take hat', 'undo', 'inventory', 'undo', 'inventory', 'look']
+
+class TestSnapshot(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.registry = server.StoryRegistry()
+        cls.runtime = cls.registry.runtime
+
+    def session(self):
+        return server.Session('test', self.registry.template('wear_eat'), self.runtime)
+
+    def play(self, thaw):
+        # thaw=True moves the session into a fresh clone before every command, as hibernation does
+        session = self.session()
+        output = [session.start()]
+        for cmd in COMMANDS:
+            if thaw:
+                snapshot = session.snapshot()
+                session = self.session()
+                session.restore(snapshot)
+            output.append(session.turn(cmd))
+        return output, session.world
+
+    def test_thawed_session_matches_resident(self):
+        resident, live = self.play(thaw=False)
+        thawed, restored = self.play(thaw=True)
+        self.assertEqual(resident, thawed)
+        self.assertEqual(sorted(live.entities), sorted(restored.entities))
+        self.assertEqual(live.verb_catalog, restored.verb_catalog)
+
+    def test_removed_entity_stays_removed(self):
+        session = self.session()
+        session.start()
+        session.turn('take apple')
+        session.turn('eat apple')
+        thawed = self.session()
+        thawed.restore(session.snapshot())
+        self.assertNotIn('apple', thawed.world.entities)
+        self.assertIn("nothing", thawed.turn('inventory'))
+        # The undo journal still holds the apple
+        thawed.turn('undo')
+        self.assertIn('apple', thawed.world.entities)
+        self.assertIn("Apple", thawed.turn('inventory'))
+
+    def test_load_brings_back_eaten_entity(self):
+        session = self.session()
+        session.start()
+        for cmd in ('take apple', 'save', 'eat apple', 'load'): session.turn(cmd)
+        self.assertIn('apple', session.world.entities)
+        self.assertIn("Apple", session.turn('inventory'))
+
+    def test_saves_belong_to_their_session(self):
+        alice, bob = self.session(), self.session()
+        alice.start()
+        bob.start()
+        alice.turn('take apple')
+        alice.turn('save')
+        self.assertIn("Nothing has been saved", bob.turn('load'))
+        self.assertIn("nothing", bob.turn('inventory'))
+        self.assertFalse(os.path.exists('wear_eat.save'))
+
+    def test_save_travels_with_snapshot(self):
+        session = self.session()
+        session.start()
+        session.turn('take apple')
+        session.turn('save')
+        session.turn('drop apple')
+        thawed = self.session()
+        thawed.restore(session.snapshot())
+        thawed.turn('load')
+        self.assertIn("Apple", thawed.turn('inventory'))
+
+    def test_history_keeps_its_limits(self):
+        session = self.session()
+        session.start()
+        # As configured by history_turns: 10; a fresh clone still has the default of 3
+        session.world.io.set_history_limits(turns=10)
+        for cmd in ['look', 'inventory'] * 3 + ['wait']: session.turn(cmd)
+        self.assertEqual(len(session.world.io.history), 6)
+        thawed = self.session()
+        thawed.restore(session.snapshot())
+        self.assertEqual(list(thawed.world.io.history), list(session.world.io.history))
+
+    def test_template_is_untouched(self):
+        self.play(thaw=True)
+        template = self.registry.template('wear_eat')
+        self.assertIn('apple', template.entities)
+        self.assertEqual(template.removed, {})
+
+if __name__ == '__main__':
+    unittest.main()
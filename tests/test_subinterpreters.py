@@ -0,0 +1,63 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+try:
+    from concurrent import interpreters
+except ImportError:
+    interpreters = None
+
+@unittest.skipUnless(interpreters, "needs concurrent.interpreters (Python 3.14+)")
+class TestStoryInterpreters(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from subinterpreters import StoryInterpreters
+
+        # Story interpreters find stories/ relative to the working directory, like the server
+        cls.folder = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.folder)
+        os.makedirs(os.path.join(cls.folder, 'stories', 'yaml'))
+        with open(os.path.join(ROOT, 'stories', 'yaml', 'dynamic_verbs.yaml'), 'r') as f:
+            data = yaml.safe_load(f)
+        # An author's condition that calls exit() while the turn runs
+        data['scenes'][0]['contents'][0]['interactions'][2]['condition'] = "exit()"
+        with open(os.path.join(cls.folder, 'stories', 'yaml', 'exits.yaml'), 'w') as f:
+            yaml.safe_dump(data, f)
+        cls.addClassCleanup(os.chdir, os.getcwd())
+        os.chdir(cls.folder)
+
+        cls.interpreters = StoryInterpreters(workers=2)
+        cls.addClassCleanup(cls.interpreters.close)
+
+    def test_plays_a_session(self):
+        session = self.interpreters.get('exits').open('a')
+        self.assertIn("Control Room", session.start())
+        self.assertIn("hums under your fingertips", session.turn("touch console"))
+        self.assertIn("Calibration is required", session.turn("push button"))
+        self.assertTrue(session.started)
+        session.close()
+
+    def test_recovers_from_exit_in_a_condition(self):
+        story = self.interpreters.get('exits')
+        session = story.open('b')
+        session.start()
+        with self.assertRaises(RuntimeError) as failure:
+            session.turn("calibrate harmonics")
+        self.assertIn("SystemExit", str(failure.exception))
+        # Only that request failed: the story, the session and new sessions carry on
+        self.assertIs(self.interpreters.get('exits'), story)
+        self.assertIn("hums under your fingertips", session.turn("touch console"))
+        other = story.open('c')
+        self.assertIn("Control Room", other.start())
+        session.close()
+        other.close()
+
+if __name__ == '__main__':
+    unittest.main()
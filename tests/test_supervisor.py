@@ -0,0 +1,120 @@
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import supervisor
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline: return False
+        time.sleep(0.05)
+    return True
+
+class TestHashRing(unittest.TestCase):
+    def test_lookup_is_stable_and_spread(self):
+        ring = supervisor.HashRing(range(4))
+        keys = [f"session-{i}" for i in range(400)]
+        slots = [ring.lookup(k) for k in keys]
+        self.assertEqual(slots, [supervisor.HashRing(range(4)).lookup(k) for k in keys])
+        self.assertEqual(set(slots), {0, 1, 2, 3})
+
+    def test_removing_a_slot_only_moves_its_keys(self):
+        full = supervisor.HashRing(range(4))
+        reduced = supervisor.HashRing([0, 1, 3])
+        for key in (f"session-{i}" for i in range(400)):
+            if full.lookup(key) != 2: self.assertEqual(reduced.lookup(key), full.lookup(key))
+
+class TestSupervisor(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Workers are separate processes that find stories/ relative to their working directory
+        cls.addClassCleanup(os.chdir, os.getcwd())
+        os.chdir(ROOT)
+        cls.folder = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.folder)
+        worker_args = ['--store', os.path.join(cls.folder, 'sessions.db'), '--hibernate-after', '1']
+        cls.supervisor = supervisor.Supervisor(processes=2, worker_args=worker_args, stories=['doors'], handshake_timeout=2)
+        cls.addClassCleanup(cls.stop)
+        threading.Thread(target=cls.supervisor.serve, kwargs={'port': 0}, daemon=True).start()
+        wait_for(lambda: all(w.alive() for w in cls.supervisor.workers))
+        cls.port = cls.supervisor.listener.getsockname()[1]
+
+    @classmethod
+    def stop(cls):
+        cls.supervisor.stopping = True
+        for worker in cls.supervisor.workers: worker.stop()
+
+    def connect(self):
+        conn = socket.create_connection(('127.0.0.1', self.port))
+        conn.settimeout(10)
+        self.addCleanup(conn.close)
+        self.assertIn(b"begin.\n> ", self.read(conn))
+        return conn
+
+    def read(self, conn, prompts=1):
+        data = b""
+        while data.count(b"> ") < prompts:
+            chunk = conn.recv(65536)
+            if not chunk: break
+            data += chunk
+        return data
+
+    def play(self, session_id):
+        conn = self.connect()
+        conn.sendall(f"play doors {session_id}\n".encode('utf-8'))
+        self.assertIn(f"[session {session_id}]".encode('utf-8'), self.read(conn))
+        return conn
+
+    def test_silent_clients_do_not_hold_up_others(self):
+        silent = [self.connect() for _ in range(40)]
+        started = time.monotonic()
+        conn = self.play('busy')
+        conn.sendall(b"take brass key\n")
+        self.assertIn(b"Taken.", self.read(conn))
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(len(silent), 40)
+
+    def test_hello_may_arrive_in_pieces(self):
+        conn = self.connect()
+        for piece in (b"pl", b"ay do", b"ors pieces\n"):
+            conn.sendall(piece)
+            time.sleep(0.05)
+        self.assertIn(b"[session pieces]", self.read(conn))
+
+    def test_unknown_story_is_refused(self):
+        conn = self.connect()
+        conn.sendall(b"play nowhere\n")
+        self.assertEqual(self.read(conn), b"Unknown story.\n> ")
+
+    def test_silent_client_times_out(self):
+        conn = self.connect()
+        self.assertEqual(conn.recv(100), b"")
+
+    def test_migrated_session_is_released_once_idle(self):
+        conn = self.play('moved')
+        # Once a turn has been answered the connection is attached and can be moved
+        conn.sendall(b"look\n")
+        self.read(conn)
+        home = self.supervisor.ring.lookup('moved')
+        self.supervisor.migrate('moved', 1 - home)
+        self.assertTrue(wait_for(lambda: self.supervisor.placement.get('moved') == 1 - home))
+        conn.sendall(b"take brass key\ninventory\n")
+        self.assertIn(b"brass key", self.read(conn, 2))
+        # Hibernated while its player is still connected: the session stays pinned
+        time.sleep(2.5)
+        self.assertEqual(self.supervisor.placement.get('moved'), 1 - home)
+        conn.close()
+        # Once the player has gone, the worker tells the supervisor it no longer holds the session
+        self.assertTrue(wait_for(lambda: 'moved' not in self.supervisor.placement))
+
+if __name__ == '__main__':
+    unittest.main()
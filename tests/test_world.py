@@ -0,0 +1,256 @@
+import os
+import sys
+import time
+import unittest
+from concurrent import futures
+from contextlib import ExitStack
+from unittest import mock
+
+import yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from compiler import generate_runtime_code
+
+RUNTIME = {}
+exec(generate_runtime_code(), RUNTIME)
+World = RUNTIME['World']
+
+def load_story(story_id):
+    with open(os.path.join(ROOT, 'stories', 'yaml', f"{story_id}.yaml"), 'r') as f:
+        return yaml.safe_load(f)
+
+class FakeAI:
+    # Stands in for AIClient: answers every request with the same candidates and records what was asked
+    def __init__(self, candidates, speculative=False):
+        self.candidates = candidates
+        self.speculative = speculative
+        self.requests = []
+        self.prefetched = []
+
+    def deadline(self):
+        return time.monotonic() + 5
+
+    def map_candidates(self, user_input, valid_commands, history, context, deadline=None):
+        self.requests.append(user_input)
+        return list(self.candidates)
+
+    def prefetch(self, user_input, valid_commands, history, context, deadline=None):
+        self.prefetched.append(user_input)
+        future = futures.Future()
+        future.set_result(list(self.candidates))
+        return future
+
+class WorldTestCase(unittest.TestCase):
+    story = 'prison_break'
+
+    def setUp(self):
+        self.sink = RUNTIME['MemorySink']()
+        self.world = World(load_story(self.story), io=RUNTIME['GameIO'](self.sink), story_id=self.story)
+        self.world._classifier = RUNTIME['IntentClassifier']()
+
+    def command(self, text):
+        self.world.parse(text)
+        self.world.io.flush()
+        return self.sink.drain()
+
+class TestSpeculation(WorldTestCase):
+    def test_unknown_verb_is_answered_by_the_prefetch(self):
+        self.world.ai = FakeAI(['push slab'], speculative=True)
+        reply = self.command("heave the slab")
+        self.assertIn("[AI Interpreted: push slab]", reply)
+        self.assertEqual(self.world.ai.prefetched, ["heave slab"])
+        # The prefetched answer is used; no second request goes out
+        self.assertEqual(self.world.ai.requests, [])
+        self.assertIsNone(self.world._pending_ai)
+
+    def test_known_verbs_are_not_prefetched(self):
+        self.world.ai = FakeAI(['push slab'], speculative=True)
+        self.assertIn("slab", self.command("examine slab"))
+        self.assertIn("shift the heavy stone slab", self.command("shove slab"))
+        self.assertEqual(self.world.ai.prefetched, [])
+
+    def test_off_unless_enabled(self):
+        self.world.ai = FakeAI(['push slab'])
+        self.assertIn("[AI Interpreted: push slab]", self.command("heave the slab"))
+        self.assertEqual(self.world.ai.prefetched, [])
+        self.assertEqual(self.world.ai.requests, ["heave slab"])
+
+class TestIntentMapper(WorldTestCase):
+    def setUp(self):
+        super().setUp()
+        self.world.move_entity('rusty shiv', 'player')
+        self.mapper = self.world.intents
+
+    def test_phrasal_verbs(self):
+        self.assertEqual(self.mapper.map("pick up shiv"), "take shiv")
+        self.assertEqual(self.mapper.map("climb into box"), "enter box")
+        self.assertEqual(self.mapper.map("inspect slab"), "examine slab")
+
+    def test_use_picks_a_verb_from_the_target(self):
+        self.assertEqual(self.mapper.map("use shiv on bars"), "unlock bars with shiv")
+        self.assertEqual(self.mapper.map("use shiv in box"), "put shiv in box")
+        self.assertIsNone(self.mapper.map("use shiv on nothing"))
+
+    def test_typos_only_in_longer_verbs(self):
+        self.assertEqual(self.mapper.map("exmaine slab"), "examine slab")
+        for text in ("wake slab", "lick bars", "hush slab"):
+            self.assertIsNone(self.mapper.map(text), text)
+
+    def test_story_synonyms_come_first(self):
+        data = load_story(self.story)
+        data['synonyms'] = {'push': ['heave'], 'examine': ['check']}
+        world = World(data, io=RUNTIME['GameIO'](RUNTIME['MemorySink']()), story_id=self.story)
+        self.assertEqual(world.intents.map("heave slab"), "push slab")
+        self.assertEqual(world.intents.map("check slab"), "examine slab")
+
+    def test_mapped_command_needs_no_ai(self):
+        self.world.ai = FakeAI([])
+        self.assertIn("A cracked stone slab", self.command("inspect the slab"))
+        self.assertIn("Dropped.", self.command("put down shiv"))
+        self.assertEqual(self.world.ai.requests, [])
+
+class TestContextBuilder(WorldTestCase):
+    def test_unbounded_room_lists_everything(self):
+        context = RUNTIME['ContextBuilder'](self.world, max_tokens=1000).build()
+        self.assertIn("iron bars (locked)", context)
+        self.assertIn("Topics: freedom, food, release", context)
+
+    def test_budget_keeps_what_the_input_mentions(self):
+        builder = RUNTIME['ContextBuilder'](self.world, max_tokens=10)
+        self.assertEqual(builder.build("ask guard about the key"), "Location: Damp Stone Cell\nVisible: Guard\nPerson 'Guard' Topics: key")
+        self.assertEqual(builder.build("open the moldy box"), "Location: Damp Stone Cell\nVisible: moldy box")
+
+    def test_recent_mentions_rank_next(self):
+        builder = RUNTIME['ContextBuilder'](self.world, max_tokens=20)
+        self.command("examine box")
+        self.assertTrue(builder.build("wave").startswith("Location: Damp Stone Cell\nVisible: moldy box, "))
+
+    def test_fragments_are_cached_per_room_and_version(self):
+        builder = self.world.context
+        fragments = builder.fragments()
+        self.assertIs(builder.fragments(), fragments)
+        self.command("shove slab")
+        self.assertIsNot(builder.fragments(), fragments)
+        self.assertIn("rusty shiv", builder.build())
+
+class TestCandidates(WorldTestCase):
+    def test_first_resolving_candidate_is_used(self):
+        self.world.ai = FakeAI(['take guard key', 'unlock bars with shiv', 'push slab', 'examine slab'])
+        reply = self.command("heave the slab")
+        self.assertEqual(reply.splitlines()[0], "[AI Interpreted: push slab]")
+        self.assertNotIn("cracked", reply)
+        self.assertEqual(self.world.entities['rusty shiv'].location_id, 'Damp Stone Cell')
+        self.assertEqual(self.world.ai.requests, ["heave slab"])
+
+    def test_dry_run_has_no_side_effects(self):
+        mentions = dict(self.world.mentions)
+        state = self.world.save_state_to_memory()
+        self.assertTrue(self.world.resolves("push slab"))
+        self.assertFalse(self.world.resolves("push guard key"))
+        self.assertFalse(self.world.resolves("lick slab"))
+        self.assertEqual(self.world.mentions, mentions)
+        self.assertEqual(self.world.save_state_to_memory(), state)
+
+    def test_no_candidate_resolves(self):
+        self.world.ai = FakeAI(['take guard key', 'lick slab'])
+        self.assertEqual(self.command("heave the slab"), "I didn't understand that.\n")
+
+    def test_candidate_that_repeats_the_input(self):
+        self.world.ai = FakeAI(['Lick the slab'])
+        self.assertEqual(self.command("lick slab"), "I understand, but I can't do that right now.\n")
+
+class TestNoFileIO(unittest.TestCase):
+    def setUp(self):
+        self.data = load_story('prison_break')
+
+    def no_file_access(self):
+        stack = ExitStack()
+        for target in ('builtins.open', 'os.path.exists', 'os.path.getmtime', 'os.stat', 'os.listdir'):
+            stack.enter_context(mock.patch(target, side_effect=AssertionError(f"{target} called")))
+        return stack
+
+    def test_creating_and_playing_a_world(self):
+        with self.no_file_access():
+            world = World(self.data, io=RUNTIME['GameIO'](RUNTIME['MemorySink']()), story_id='prison_break')
+            session = world.clone()
+            session.intro()
+            for cmd in ('look', 'shove slab', 'take shiv', 'inventory', 'undo'): session.parse(cmd)
+
+    def test_config_is_read_once_per_process(self):
+        first = World(self.data, io=RUNTIME['GameIO'](RUNTIME['MemorySink']()), story_id='prison_break')
+        first.ai.config
+        second = World(self.data, io=RUNTIME['GameIO'](RUNTIME['MemorySink']()), story_id='prison_break')
+        with self.no_file_access():
+            self.assertIs(second.ai.config, first.ai.config)
+
+class TestClone(unittest.TestCase):
+    def setUp(self):
+        self.data = load_story('prison_break')
+        self.template = World(self.data, story_id='prison_break')
+
+    def session(self):
+        sink = RUNTIME['MemorySink']()
+        return self.template.clone(RUNTIME['GameIO'](sink)), sink
+
+    def test_clones_do_not_share_state(self):
+        before = self.template.save_state_to_memory()
+        played, _ = self.session()
+        other, _ = self.session()
+        counters = {id(w): (w.turn, w.version, dict(w.mentions), list(w.history)) for w in (self.template, other)}
+        for cmd in ('shove slab', 'take shiv', 'open box', 'unlock bars with shiv', 'ask guard about key'):
+            played.parse(cmd)
+        self.assertEqual(played.entities['rusty shiv'].location_id, 'player')
+        self.assertFalse(played.entities['iron bars'].has_prop('locked'))
+        for world in (self.template, other):
+            self.assertEqual(world.save_state_to_memory(), before)
+            self.assertEqual(world.entities['rusty shiv'].location_id, 'off-stage')
+            self.assertNotIn('rusty shiv', world.get_player().contents)
+            self.assertTrue(world.entities['iron bars'].has_prop('locked'))
+            self.assertEqual((world.turn, world.version, world.mentions, world.history), counters[id(world)])
+
+    def test_clone_matches_a_fresh_world(self):
+        session, sink = self.session()
+        fresh_sink = RUNTIME['MemorySink']()
+        fresh = World(load_story('prison_break'), io=RUNTIME['GameIO'](fresh_sink), story_id='prison_break')
+        for world in (session, fresh):
+            world.intro()
+            for cmd in ('shove slab', 'take shiv', 'unlock bars with shiv', 'north'): world.parse(cmd)
+            world.io.flush()
+        self.assertEqual(sink.drain(), fresh_sink.drain())
+        self.assertEqual(session.save_state_to_memory(), fresh.save_state_to_memory())
+
+    def test_building_worlds_leaves_the_story_data_alone(self):
+        data = load_story('prison_break')
+        World(self.data, story_id='prison_break')
+        self.assertEqual(self.data, data)
+
+class TestPromptPrefix(unittest.TestCase):
+    def setUp(self):
+        data = load_story('wear_eat')
+        data['scenes'][0]['contents'][1]['interactions'] = [{'verb': 'polish', 'type': 'before', 'message': "It shines."}]
+        self.template = World(data, story_id='wear_eat')
+        self.world = self.template.clone(RUNTIME['GameIO'](RUNTIME['MemorySink']()))
+
+    def prefix(self, world):
+        return world.ai.build_messages("frob", world.get_valid_commands(), "", "ctx")[0]['content']
+
+    def test_prefix_is_fixed_for_the_story(self):
+        before = self.prefix(self.world)
+        self.assertIn("- polish [noun]", before)
+        for cmd in ('take apple', 'eat apple'): self.world.parse(cmd)
+        # The eaten apple's verb leaves the scoped list and the parser, but not the prompt prefix
+        self.assertNotIn('polish', self.world.verb_catalog)
+        self.assertNotIn("polish [noun]", self.world.get_valid_commands())
+        self.assertEqual(self.prefix(self.world), before)
+
+        thawed = self.template.clone()
+        thawed.restore(self.world.snapshot())
+        self.assertEqual(self.prefix(thawed), before)
+        self.world.parse('undo')
+        self.assertIn('polish', self.world.verb_catalog)
+        self.assertEqual(self.prefix(self.world), before)
+
+if __name__ == '__main__':
+    unittest.main()